@@ -3,6 +3,7 @@ from django.contrib import admin
 from django.contrib.contenttypes.models import ContentType
 from django.core.urlresolvers import reverse
 
+import constants as c
 import models
 
 
@@ -89,7 +90,7 @@ class CompanyAdmin(admin.ModelAdmin):
     
     def enable_load(self, request, queryset):
         models.Company.objects.filter(cik__in=queryset).update(load=True)
-        models.Index.objects.filter(company__cik__in=queryset, attributes_loaded=True).update(attributes_loaded=False)
+        models.Index.objects.filter(company__cik__in=queryset, attributes_loaded=True).update(attributes_loaded=False, status=c.PENDING)
     enable_load.short_description = 'Enable attribute loading of selected %(verbose_name_plural)s'
     
     def disable_load(self, request, queryset):
@@ -123,15 +124,18 @@ class CompanyAdmin(admin.ModelAdmin):
 class IndexFileAdmin(admin.ModelAdmin):
     list_display = ('year',
                     'quarter',
+                    'status',
                     'downloaded',
                     'complete',)
     
+    list_filter = ('status',)
+    
     actions = ('mark_unprocessed',)
     
     def mark_unprocessed(self, request, queryset):
         models.IndexFile.objects\
             .filter(id__in=queryset.values_list('id', flat=True))\
-            .update(complete=None, downloaded=None)
+            .update(complete=None, downloaded=None, status=c.PENDING)
     mark_unprocessed.short_description = 'Mark selected %(verbose_name_plural)s as unprocessed'
     
     def get_readonly_fields(self, request, obj=None):
@@ -152,12 +156,14 @@ class IndexAdmin(admin.ModelAdmin):
                     'date',
                     'quarter',
                     'attributes_loaded',
+                    'status',
                     'valid',)
 
     search_fields = ('filename',
                      'company__name',)
     
     list_filter = ('attributes_loaded',
+                   'status',
                    'valid',
                    'year',
                    'quarter',
@@ -5,6 +5,34 @@ TIME_PERIODS = (
     DURATION,
 )
 
+# Kinds of reporting period a context can cover. Durations that are none
+# of these are DURATION.
+FISCAL_YEAR = 'FY'
+FISCAL_QUARTER = 'FQ'
+YEAR_TO_DATE = 'YTD'
+PERIOD_KINDS = (
+    INSTANT,
+    FISCAL_YEAR,
+    FISCAL_QUARTER,
+    YEAR_TO_DATE,
+    DURATION,
+)
+
 MAX_DIGITS = 40
 MAX_DECIMALS = 6
-MAX_QUANTIZE = MAX_DIGITS - MAX_DECIMALS
\ No newline at end of file
+MAX_QUANTIZE = MAX_DIGITS - MAX_DECIMALS
+
+# Import status of a filing or quarterly index. Each moves through these in
+# order as it is imported, or to FAILED, recording when it reached each.
+PENDING = 'pending'
+DOWNLOADED = 'downloaded'
+PARSED = 'parsed'
+LOADED = 'loaded'
+FAILED = 'failed'
+STATUSES = (
+    PENDING,
+    DOWNLOADED,
+    PARSED,
+    LOADED,
+    FAILED,
+)
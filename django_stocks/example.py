@@ -6,25 +6,26 @@ filing = Index.objects.filter(form='10-K',cik=1090872).order_by('-date')[0]
 
 print filing.name
 
-"""initialize XBRL parser and populate an attribute called fields with a dict of 50 common terms"""
-x = latest.xbrl()
+"""initialize XBRL parser and populate an attribute called fields with the filing's dei: values"""
+x = filing.xbrl()
 
-print x.fields['FiscalYear']
+print x.fields['DocumentFiscalYearFocus']
 
 print x.fields
 
 """fetch arbitrary XBRL tags representing eiter an Instant or a Duration in time"""
 print 'Tax rate', x.GetFactValue('us-gaap:EffectiveIncomeTaxRateContinuingOperations','Duration')
 
-if x.loadYear(1): 
+"""every context without dimensions is classified when the filing is parsed, as a kind of period
+(Instant, FY, FQ, YTD or another Duration) and how many years before the document period it ends"""
+for context_id, period in x.periods.items():
+    print context_id, period.kind, period.years_back
+
+if x.loadYear(1):
     """Most 10-Ks have two or three previous years contained in them for the major values. This call switches the contexts
-    to the prior year (set it to 2 or 3 instead of 1 to go back further) and reloads the fundamental concepts.
-    Any calls to GetFactValue will use that year's value from that point on."""
-                    
-    print x.fields['FiscalYear']
+    to the prior year (set it to 2 or 3 instead of 1 to go back further) using the classification above, without
+    parsing the filing again. Any calls to GetFactValue will use that year's value from that point on."""
 
-    print x.fields
+    print x.fields['ContextForDurations']
 
     print 'Tax rate', x.GetFactValue('us-gaap:EffectiveIncomeTaxRateContinuingOperations','Duration')
-            
-
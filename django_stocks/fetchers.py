@@ -0,0 +1,398 @@
+"""
+Backends used to retrieve files from EDGAR.
+
+Every download goes through the fetcher returned by get_fetcher(), chosen
+with the DJANGO_STOCKS_FETCHER setting. HTTPFetcher talks to sec.gov,
+MirrorFetcher serves the same URLs from a local copy of EDGAR.
+"""
+from contextlib import contextmanager
+from email.utils import formatdate, parsedate_tz, mktime_tz
+import httplib
+import logging
+import os
+import re
+import socket
+import tempfile
+import threading
+import time
+import urlparse
+
+from django.utils.module_loading import import_string
+
+from django_stocks import settings
+from django_stocks.throttle import get_governor
+
+logger = logging.getLogger(__name__)
+
+# Number of bytes copied at a time when saving a response to disk.
+CHUNK_SIZE = 64 * 1024
+
+# Maximum number of redirects followed for a single request.
+MAX_REDIRECTS = 5
+
+
+class FetchError(IOError):
+    """
+    Raised when a file cannot be retrieved.
+    """
+
+    def __init__(self, url, status=None, reason=''):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        # Connection problems, server errors and throttling may succeed
+        # if tried again later; anything else will not.
+        self.transient = status is None or status >= 500 or status == 429
+        super(FetchError, self).__init__('%s: %s %s' % (url, status or '', reason))
+
+
+class Response(object):
+    """
+    A file-like response.
+
+    `headers` maps lower case header names to values. Connection errors
+    while the body is read raise a transient FetchError, so that callers
+    retry them like any other failed request.
+    """
+
+    def __init__(self, url, status, headers, fileobj, on_close=None):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self._fileobj = fileobj
+        self._on_close = on_close
+
+    def read(self, size=-1):
+        if self._fileobj is None:
+            return ''
+        try:
+            if size is None or size < 0:
+                return self._fileobj.read()
+            return self._fileobj.read(size)
+        except (httplib.HTTPException, socket.error) as e:
+            raise FetchError(self.url, reason='Reading the response failed: %r' % e)
+
+    def close(self):
+        if self._on_close:
+            self._on_close(self)
+            self._on_close = None
+        if self._fileobj is not None:
+            self._fileobj.close()
+            self._fileobj = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class Fetcher(object):
+    """
+    Base class for fetchers.
+
+    Subclasses implement open(), which returns a Response for any status
+    below 400 and raises FetchError otherwise.
+    """
+
+    def __init__(self, retries=None, backoff=None):
+        self.retries = settings.FETCH_RETRIES if retries is None else retries
+        self.backoff = settings.FETCH_BACKOFF if backoff is None else backoff
+
+    def open(self, url, headers=None, method='GET'):
+        raise NotImplementedError
+
+    def _retry(self, url, func):
+        """
+        Calls `func`, retrying with exponential backoff while it fails
+        with a transient error.
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                return func()
+            except FetchError as e:
+                if not e.transient or attempt == self.retries:
+                    raise
+                delay = self.backoff * 2 ** attempt
+                logger.warning('Retrying %s in %.1fs: %s', url, delay, e)
+                time.sleep(delay)
+
+    def read(self, url, headers=None):
+        """
+        Returns the body of `url`.
+        """
+        def read():
+            with self.open(url, headers=headers) as response:
+                data = response.read()
+                check_length(response, len(data))
+                return data
+        return self._retry(url, read)
+
+    def download(self, url, fn, headers=None):
+        """
+        Saves `url` to `fn`, streaming into a temporary file in the same
+        directory that is renamed into place once complete, so `fn` never
+        holds a partial transfer.
+
+        Returns the response, or None if the server answered a conditional
+        request with 304 Not Modified.
+        """
+        def download():
+            with self.open(url, headers=headers) as response:
+                if response.status == 304:
+                    return None
+                save_response(response, fn)
+                return response
+        return self._retry(url, download)
+
+
+@contextmanager
+def atomic_write(fn):
+    """
+    Yields a temporary file in the same directory as `fn`, open for
+    writing, that is renamed to `fn` if the block completes and removed
+    if it raises, so `fn` never holds partial contents.
+    """
+    fd, tmp_fn = tempfile.mkstemp(
+        dir=os.path.dirname(fn) or '.', prefix=os.path.basename(fn), suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as fileout:
+            yield fileout
+        os.rename(tmp_fn, fn)
+    except:
+        if os.path.exists(tmp_fn):
+            os.remove(tmp_fn)
+        raise
+
+
+def save_response(response, fn):
+    """
+    Streams the rest of `response` into `fn` with atomic_write(), raising
+    FetchError unless its full Content-Length arrived.
+    """
+    with atomic_write(fn) as fileout:
+        size = 0
+        while True:
+            chunk = response.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            fileout.write(chunk)
+            size += len(chunk)
+        check_length(response, size)
+
+
+def check_length(response, size):
+    """
+    Raises FetchError if fewer or more bytes were received than the
+    response's Content-Length announced.
+    """
+    expected = response.headers.get('content-length')
+    if response.status in (200, 206) and expected is not None and int(expected) != size:
+        raise FetchError(response.url, reason='Received %d of %s bytes' % (size, expected))
+
+
+class ConnectionPool(object):
+    """
+    Keeps idle keep-alive connections per host so that they can be reused
+    by any thread. At most `size` idle connections are kept per host.
+    """
+
+    def __init__(self, size, timeout):
+        self.size = size
+        self.timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get(self, scheme, host):
+        with self._lock:
+            idle = self._idle.get((scheme, host))
+            if idle:
+                return idle.pop()
+        if scheme == 'https':
+            return httplib.HTTPSConnection(host, timeout=self.timeout)
+        return httplib.HTTPConnection(host, timeout=self.timeout)
+
+    def put(self, scheme, host, conn):
+        with self._lock:
+            idle = self._idle.setdefault((scheme, host), [])
+            if len(idle) < self.size:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+
+class HTTPFetcher(Fetcher):
+    """
+    Fetches over HTTP(S), reusing keep-alive connections from a pool
+    shared by every thread of the process.
+
+    Every request first takes a token from the shared rate governor.
+    """
+
+    def __init__(self, user_agent=None, timeout=None, pool_size=None, **kwargs):
+        super(HTTPFetcher, self).__init__(**kwargs)
+        self.user_agent = user_agent or settings.USER_AGENT
+        self.pool = ConnectionPool(
+            pool_size or settings.POOL_SIZE,
+            timeout or settings.FETCH_TIMEOUT)
+
+    def _request(self, url, headers, method):
+        parts = urlparse.urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        request_headers = {'User-Agent': self.user_agent}
+        request_headers.update(headers or {})
+        # An idle keep-alive connection may have been closed by the
+        # server, so a failure on a reused socket is retried once.
+        get_governor().acquire()
+        for attempt in range(2):
+            conn = self.pool.get(parts.scheme, parts.netloc)
+            try:
+                conn.request(method, path, headers=request_headers)
+                return parts, conn, conn.getresponse()
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                if attempt:
+                    raise
+
+    def open(self, url, headers=None, method='GET'):
+        for _ in range(MAX_REDIRECTS + 1):
+            try:
+                parts, conn, response = self._request(url, headers, method)
+            except (httplib.HTTPException, socket.error) as e:
+                raise FetchError(url, reason=str(e))
+            response_headers = dict((k.lower(), v) for k, v in response.getheaders())
+            if response.status in (301, 302, 303, 307, 308) and 'location' in response_headers:
+                response.read()
+                self.pool.put(parts.scheme, parts.netloc, conn)
+                url = urlparse.urljoin(url, response_headers['location'])
+                continue
+            if response.status >= 400:
+                response.read()
+                self.pool.put(parts.scheme, parts.netloc, conn)
+                raise FetchError(url, response.status, response.reason)
+
+            def on_close(r, response=response, parts=parts, conn=conn):
+                # The connection can only be reused once the body has
+                # been consumed.
+                if response.isclosed() and not response.will_close:
+                    self.pool.put(parts.scheme, parts.netloc, conn)
+                else:
+                    conn.close()
+            return Response(url, response.status, response_headers, response, on_close)
+        raise FetchError(url, reason='Too many redirects')
+
+
+class MirrorFetcher(Fetcher):
+    """
+    Serves EDGAR URLs from a local directory tree, mapping the path of
+    each URL below `root`, e.g. a copy of sec.gov made with `wget -m`.
+    Query strings are kept in the file name, as wget does.
+    """
+
+    def __init__(self, root=None, **kwargs):
+        super(MirrorFetcher, self).__init__(**kwargs)
+        self.root = os.path.abspath(root or settings.MIRROR_DIR)
+
+    def localpath(self, url):
+        parts = urlparse.urlsplit(url)
+        path = parts.path
+        if parts.query:
+            path += '?' + parts.query
+        fn = os.path.normpath(os.path.join(self.root, path.lstrip('/')))
+        if not fn.startswith(self.root + os.sep):
+            raise FetchError(url, 403, 'Outside of mirror')
+        return fn
+
+    def open(self, url, headers=None, method='GET'):
+        fn = self.localpath(url)
+        if not os.path.isfile(fn):
+            raise FetchError(url, 404, 'Not Found')
+        stat = os.stat(fn)
+        etag = '"%x-%x"' % (int(stat.st_mtime), stat.st_size)
+        response_headers = {
+            'content-length': str(stat.st_size),
+            'last-modified': formatdate(stat.st_mtime, usegmt=True),
+            'etag': etag,
+            'accept-ranges': 'bytes',
+        }
+        headers = dict((k.lower(), v) for k, v in (headers or {}).items())
+        since = parsedate_tz(headers.get('if-modified-since') or '')
+        if headers.get('if-none-match') == etag \
+                or (since and int(stat.st_mtime) <= mktime_tz(since)):
+            return Response(url, 304, response_headers, None)
+
+        status = 200
+        start, length = 0, stat.st_size
+        byte_range = parse_range(headers.get('range'), stat.st_size)
+        if byte_range:
+            status = 206
+            start, end = byte_range
+            length = end - start + 1
+            response_headers['content-range'] = 'bytes %d-%d/%d' % (start, end, stat.st_size)
+            response_headers['content-length'] = str(length)
+        if method == 'HEAD':
+            return Response(url, status, response_headers, None)
+        fileobj = open(fn, 'rb')
+        fileobj.seek(start)
+        return Response(url, status, response_headers, FileSlice(fileobj, length))
+
+
+class FileSlice(object):
+    """
+    Reads at most `length` bytes from a file object.
+    """
+
+    def __init__(self, fileobj, length):
+        self.fileobj = fileobj
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fileobj.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.fileobj.close()
+
+
+def parse_range(value, size):
+    """
+    Returns the inclusive (start, end) offsets of a single range Range
+    header for a resource of `size` bytes, or None if there is none.
+    """
+    match = re.match(r'^bytes=(\d*)-(\d*)$', (value or '').strip())
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+    if not match.group(1):
+        start = max(0, size - int(match.group(2)))
+        end = size - 1
+    else:
+        start = int(match.group(1))
+        end = min(size - 1, int(match.group(2))) if match.group(2) else size - 1
+    if start > end:
+        raise FetchError(value, 416, 'Requested Range Not Satisfiable')
+    return start, end
+
+
+_fetcher = None
+
+
+def get_fetcher():
+    """
+    Returns the fetcher configured by the DJANGO_STOCKS_FETCHER setting.
+    """
+    global _fetcher
+    if _fetcher is None:
+        _fetcher = import_string(settings.FETCHER)()
+    return _fetcher
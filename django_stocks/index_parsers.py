@@ -0,0 +1,153 @@
+"""
+Streaming parsers for the EDGAR quarterly full-index files.
+"""
+from collections import namedtuple
+from datetime import date
+import hashlib
+
+# Forms we keep from the quarterly indexes.
+TARGET_FORMS = frozenset(['10-K', '10-Q', '20-F', '10-K/A', '10-Q/A', '20-F/A'])
+
+# Number of bytes read from the index file at a time.
+CHUNK_SIZE = 64 * 1024
+
+IndexRecord = namedtuple('IndexRecord', 'cik name form date filename')
+
+
+def iter_lines(fileobj, chunk_size=CHUNK_SIZE):
+    """
+    Yields the lines of a file object, reading it in fixed size chunks
+    so that memory use does not grow with the size of the file.
+    """
+    pending = ''
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            break
+        lines = (pending + chunk).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+
+class HashingReader(object):
+    """
+    Wraps a file object, keeping the SHA1, size and line count of
+    everything read through it after the preamble.
+
+    The preamble is left out since its Last Data Received date changes
+    on every update, while the data lines are only ever appended to.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.sha1 = hashlib.sha1()
+        self.size = 0
+        self.line_count = 0
+
+    def skip_header(self):
+        """
+        Reads and discards the preamble of an index file, up to and
+        including the line of dashes under the column titles.
+        """
+        for line in iter(self.fileobj.readline, ''):
+            if line.startswith('---'):
+                break
+        return self
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.sha1.update(data)
+        self.size += len(data)
+        self.line_count += data.count('\n')
+        return data
+
+    def skip(self, size, chunk_size=CHUNK_SIZE):
+        """
+        Reads and discards up to `size` bytes.
+        """
+        while self.size < size:
+            if not self.read(min(chunk_size, size - self.size)):
+                break
+
+    def hexdigest(self):
+        return self.sha1.hexdigest()
+
+
+def skip_header(lines):
+    """
+    Consumes the preamble of an index file, up to and including the
+    line of dashes under the column titles.
+    """
+    for line in lines:
+        if line.startswith('---'):
+            break
+    return lines
+
+
+def parse_date(value):
+    """
+    Converts a YYYY-MM-DD or YYYYMMDD string to a date.
+    """
+    if len(value) == 8:
+        return date(int(value[0:4]), int(value[4:6]), int(value[6:8]))
+    return date(int(value[0:4]), int(value[5:7]), int(value[8:10]))
+
+
+def parse_company_index(fileobj, forms=TARGET_FORMS, header=True):
+    """
+    Yields an IndexRecord for every line of a fixed width company.idx
+    whose form type is in `forms`.
+
+    Only the form column is inspected for the other lines, so the bulk of
+    the file is skipped without slicing or converting the other columns.
+    Pass header=False when `fileobj` is positioned past the preamble.
+    """
+    lines = iter_lines(fileobj)
+    if header:
+        lines = skip_header(lines)
+    for line in lines:
+        form = line[62:74].strip()
+        if form not in forms:
+            continue
+        yield IndexRecord(
+            cik=int(line[74:86]),
+            name=line[0:62].strip(),
+            form=form,
+            date=parse_date(line[86:98].strip()),
+            filename=line[98:].strip())
+
+
+def parse_master_index(fileobj, forms=TARGET_FORMS, header=True):
+    """
+    Yields an IndexRecord for every line of a pipe delimited master.idx
+    or xbrl.idx whose form type is in `forms`.
+    """
+    lines = iter_lines(fileobj)
+    if header:
+        lines = skip_header(lines)
+    for line in lines:
+        parts = line.split('|')
+        if len(parts) != 5 or parts[2] not in forms:
+            continue
+        cik, name, form, dt, filename = parts
+        yield IndexRecord(
+            cik=int(cik),
+            name=name.strip(),
+            form=form,
+            date=parse_date(dt.strip()),
+            filename=filename.strip())
+
+
+# Maps each supported quarterly index to its archive name, the index
+# member inside that archive and the parser for its layout.
+# xbrl.idx only lists filings that include an XBRL exhibit.
+INDEX_SOURCES = {
+    'company': ('company.zip', 'company.idx', parse_company_index),
+    'master': ('master.zip', 'master.idx', parse_master_index),
+    'xbrl': ('xbrl.zip', 'xbrl.idx', parse_master_index),
+}
+
+DEFAULT_SOURCE = 'company'
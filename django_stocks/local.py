@@ -0,0 +1,71 @@
+"""
+Runs task functions in a local pool of processes instead of through
+Celery, for single machine imports and benchmarks without a broker.
+"""
+from StringIO import StringIO
+import multiprocessing
+import time
+import traceback
+
+from django.db import connections
+
+from django_stocks.tasks import print_progress
+
+# Number of failures listed in the summary.
+MAX_REPORTED_FAILURES = 10
+
+
+def _run(job):
+    func, args, kwargs = job
+    start = time.time()
+    try:
+        result = func(*args, **kwargs)
+    except Exception:
+        ferr = StringIO()
+        traceback.print_exc(file=ferr)
+        return job, False, ferr.getvalue(), time.time() - start
+    return job, result is not False, None, time.time() - start
+
+
+def run_jobs(jobs, workers, describe=None):
+    """
+    Calls each (function, args, kwargs) job in a pool of `workers`
+    processes, printing progress as they finish and a summary at the end.
+    A job fails if it raises or returns False.
+
+    The functions, which may be Celery tasks, must be importable by the
+    worker processes. Returns the number of failed jobs.
+    """
+    jobs = list(jobs)
+    total = len(jobs)
+    describe = describe or (lambda job: '%s%r' % (getattr(job[0], 'name', job[0].__name__), job[1]))
+    # Each process opens its own database connections rather than sharing
+    # the sockets it would inherit.
+    connections.close_all()
+    pool = multiprocessing.Pool(workers)
+    start = time.time()
+    busy = 0.0
+    failures = []
+    try:
+        for i, (job, ok, error, elapsed) in enumerate(pool.imap_unordered(_run, jobs), 1):
+            busy += elapsed
+            if not ok:
+                failures.append((job, error))
+            print_progress('%s %s in %.2fs' % (describe(job), 'done' if ok else 'FAILED', elapsed), i, total)
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    elapsed = time.time() - start
+    print 'Ran %d jobs in %.1fs with %d processes: %.2f jobs/s, %.2fs per job, %d failed.' % (
+        total, elapsed, workers, total / elapsed if elapsed else 0, busy / total if total else 0, len(failures))
+    for job, error in failures[:MAX_REPORTED_FAILURES]:
+        print 'Failed: %s' % describe(job)
+        if error:
+            print error.rstrip()
+    if len(failures) > MAX_REPORTED_FAILURES:
+        print '... and %d more failures.' % (len(failures) - MAX_REPORTED_FAILURES)
+    return len(failures)
@@ -0,0 +1,127 @@
+"""
+Worker level caches of the small tables that facts refer to.
+
+A filing has tens of thousands of facts but only uses a few hundred
+distinct namespaces, attributes and units, which rarely change. These
+caches resolve all the names a filing uses at once, creating the missing
+rows in bulk, and remember the ids for later filings.
+"""
+from collections import OrderedDict
+import threading
+
+from django.db import IntegrityError, connection, transaction
+
+from django_stocks import settings
+from django_stocks.models import Attribute, Namespace, Unit, LOOKUP_CHUNK_SIZE
+
+# How many times rows created concurrently by another worker are looked
+# up again before giving up.
+CREATE_ATTEMPTS = 3
+
+
+class LookupCache(object):
+    """
+    Maps the natural keys of a model's rows to their ids, keeping the
+    `size` most recently used.
+
+    Keys are tuples of the values of `fields`, all of which together must
+    be unique, e.g. ('namespace_id', 'name') for Attribute.
+    """
+
+    def __init__(self, model, fields, size=None):
+        self.model = model
+        self.fields = tuple(fields)
+        self.size = size or settings.LOOKUP_CACHE_SIZE
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _store(self, ids):
+        with self._lock:
+            for key, id in ids.iteritems():
+                self._ids.pop(key, None)
+                self._ids[key] = id
+            while len(self._ids) > self.size:
+                self._ids.popitem(last=False)
+
+    def _fetch(self, keys):
+        """
+        Returns the ids of the rows that exist for `keys`, grouping them
+        by all but the last field and querying the last with IN.
+        """
+        groups = {}
+        for key in keys:
+            groups.setdefault(key[:-1], []).append(key[-1])
+        ids = {}
+        prefix_fields = self.fields[:-1]
+        last_field = self.fields[-1]
+        for prefix, values in groups.iteritems():
+            for i in range(0, len(values), LOOKUP_CHUNK_SIZE):
+                q = self.model.objects.filter(**dict(zip(prefix_fields, prefix)))
+                q = q.filter(**{last_field + '__in': values[i:i + LOOKUP_CHUNK_SIZE]})
+                for row in q.values_list(*(self.fields + ('id',))):
+                    ids[row[:-1]] = row[-1]
+        return ids
+
+    def get_many(self, keys):
+        """
+        Returns a dict mapping each key to the id of its row, creating the
+        rows that do not exist yet.
+        """
+        keys = set(keys)
+        ids = {}
+        with self._lock:
+            for key in keys:
+                id = self._ids.pop(key, None)
+                if id is not None:
+                    self._ids[key] = id
+                    ids[key] = id
+            self.hits += len(ids)
+            self.misses += len(keys) - len(ids)
+        missing = keys.difference(ids)
+        if not missing:
+            return ids
+
+        found = self._fetch(missing)
+        created = {}
+        for attempt in range(CREATE_ATTEMPTS):
+            missing.difference_update(found)
+            missing.difference_update(created)
+            if not missing:
+                break
+            try:
+                with transaction.atomic():
+                    self.model.objects.bulk_create([
+                        self.model(**dict(zip(self.fields, key))) for key in missing])
+            except IntegrityError:
+                # Another worker created some of them first.
+                if attempt == CREATE_ATTEMPTS - 1:
+                    raise
+                found.update(self._fetch(missing))
+                continue
+            # bulk_create() does not set ids on every database.
+            created.update(self._fetch(missing))
+
+        self._store(found)
+        if connection.in_atomic_block:
+            # Rows created inside a transaction only exist once it commits.
+            transaction.on_commit(lambda: self._store(created))
+        else:
+            self._store(created)
+        ids.update(found)
+        ids.update(created)
+        return ids
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses, size=len(self._ids))
+
+
+namespaces = LookupCache(Namespace, ('name',))
+attributes = LookupCache(Attribute, ('namespace_id', 'name'))
+units = LookupCache(Unit, ('name',))
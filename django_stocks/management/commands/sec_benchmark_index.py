@@ -0,0 +1,64 @@
+from datetime import date
+import time
+from zipfile import ZipFile
+
+from django.core.management.base import BaseCommand, CommandError
+
+from django_stocks.index_parsers import TARGET_FORMS, iter_lines, parse_company_index
+
+
+def legacy_parse(zip_path):
+    """
+    The original get_filing_list loop, kept for comparison.
+    """
+    records = []
+    lines = ZipFile(zip_path).read('company.idx').split('\n')
+    for form_line in lines[10:]:
+        if form_line.strip() == '':
+            continue
+        cik = int(form_line[74:86].strip())
+        filename = form_line[98:].strip()
+        form = form_line[62:74].strip()
+        name = form_line[0:62].strip()
+        dt = form_line[86:98].strip()
+        dt = date(*map(int, dt.split('-')))
+        if form in TARGET_FORMS:
+            records.append((cik, name, form, dt, filename))
+    return len(records)
+
+
+def streaming_parse(zip_path):
+    count = 0
+    with ZipFile(zip_path) as zip:
+        for _ in parse_company_index(zip.open('company.idx')):
+            count += 1
+    return count
+
+
+class Command(BaseCommand):
+    help = 'Compares the parsing speed of a company.zip quarterly index.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path',
+                            help='Path to a downloaded company.zip.')
+        parser.add_argument('--repeat',
+                            default=3,
+                            type=int)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            with ZipFile(path) as zip:
+                total_lines = sum(1 for _ in iter_lines(zip.open('company.idx')))
+        except (IOError, KeyError) as e:
+            raise CommandError('Unable to read %s: %s' % (path, e))
+
+        for label, parse in (('legacy', legacy_parse), ('streaming', streaming_parse)):
+            best = None
+            for _ in range(options['repeat']):
+                start = time.time()
+                matched = parse(path)
+                elapsed = time.time() - start
+                best = elapsed if best is None else min(best, elapsed)
+            self.stdout.write('%-10s %d lines, %d matched, %.3fs, %d lines/sec' % (
+                label, total_lines, matched, best, total_lines / max(best, 1e-9)))
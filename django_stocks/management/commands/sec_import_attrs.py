@@ -7,11 +7,20 @@ import sys
 import time
 import traceback
 
-from django.core.management.base import BaseCommand
+from celery.backends.base import DisabledBackend
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
 from django.db import DatabaseError
 
 from django_stocks import models
-from django_stocks.tasks import import_attrs
+from django_stocks.celery import app
+from django_stocks.local import run_jobs
+from django_stocks.routing import STAGES, queue_depth
+from django_stocks.settings import LARGE_FILING_SIZE, LARGE_QUEUE, XBRL_CACHE
+from django_stocks.tasks import import_attrs_batch, import_attrs_pipeline, load_index, print_progress
+
+# Seconds between checks of the outstanding tasks while the window is full.
+POLL_INTERVAL = 2
 
 
 class Command(BaseCommand):
@@ -39,9 +48,63 @@ class Command(BaseCommand):
         parser.add_argument('--verbose',
                             action='store_true',
                             default=False)
+        parser.add_argument('--batch-size',
+                            type=int,
+                            default=25,
+                            help='The number of filings loaded by each task.')
+        parser.add_argument('--pipeline',
+                            action='store_true',
+                            default=False,
+                            help='Download, parse and load each filing in separate '
+                                 'tasks on the queues of django_stocks.routing.')
+        parser.add_argument('--local-workers',
+                            type=int,
+                            default=0,
+                            help='Import in this many local processes instead of '
+                                 'queueing Celery tasks.')
+        parser.add_argument('--window',
+                            type=int,
+                            default=100,
+                            help='The maximum number of queued tasks that have not '
+                                 'finished. Queueing pauses while it is reached.')
+        parser.add_argument('--large-size',
+                            type=int,
+                            default=LARGE_FILING_SIZE,
+                            help='Filings whose XBRL archive has at least this many bytes '
+                                 'are queued first, largest first, on the large queue. '
+                                 '0 disables this.')
+        parser.add_argument('--fetch-sizes',
+                            action='store_true',
+                            default=False,
+                            help='Look up the archive size of filings not yet downloaded '
+                                 'with HEAD requests before queueing.')
+
+    def wait_for_window(self, pending, queues, window):
+        """
+        Blocks until fewer than `window` tasks are outstanding, tracking
+        their results if there is a result backend and otherwise the
+        number of messages waiting in their queues.
+        """
+        while True:
+            if isinstance(app.backend, DisabledBackend):
+                outstanding = 0
+                for queue in queues:
+                    depth = queue_depth(app, queue)
+                    if depth:
+                        outstanding += depth[0]
+            else:
+                pending[:] = [result for result in pending if not result.ready()]
+                outstanding = len(pending)
+            if outstanding < window:
+                return
+            time.sleep(POLL_INTERVAL)
 
     def handle(self, *args, **options):
         options['forms'] = options['forms'].split(',')
+        if options['pipeline'] and not XBRL_CACHE:
+            # The load stage would parse every filing again.
+            raise CommandError('--pipeline passes parsed filings from the parse stage to the '
+                               'load stage through DJANGO_STOCKS_XBRL_CACHE, which is off.')
 
         try:
             # Get a file from the index.
@@ -64,17 +127,75 @@ class Command(BaseCommand):
                 q = q.filter(company__cik=options['cik'])
             if not options['force']:
                 q = q.filter(company__load=True)
-            if not q.count():
+            # Consecutive filings of a company share its directory, so
+            # workers find recently read files still in the disk cache.
+            index_ids = list(q.order_by('company', 'date', 'id').values_list('id', flat=True))
+            total_count = len(index_ids)
+            if not total_count:
                 print>>sys.stderr, ('Warning: the company you specified with cik %s is '
                                     'either not marked for loading or does not exist.') % (options['cik'])
 
-            total_count = q.count()
-            current_count = 0
-            commit_freq = 300
-            kwargs = options.copy()
-            for ifile in q.iterator():
-                kwargs['filename'] = ifile.filename
-                import_attrs.delay(**kwargs)
+            if options['fetch_sizes']:
+                unsized = q.filter(xbrl_size__isnull=True).select_related('company')
+                unsized_count = unsized.count()
+                for i, ifile in enumerate(unsized.iterator(), 1):
+                    ifile.fetch_size()
+                    print_progress('Sized', i, unsized_count)
+
+            # Start the largest filings first, so that they run alongside
+            # the many small ones instead of after them.
+            large_ids = []
+            if options['large_size'] > 0:
+                large_ids = list(q.filter(xbrl_size__gte=options['large_size'])
+                                  .order_by('-xbrl_size', 'id').values_list('id', flat=True))
+                large = set(large_ids)
+                index_ids = [index_id for index_id in index_ids if index_id not in large]
+
+            if options['local_workers']:
+                filenames = dict(q.values_list('id', 'filename'))
+                run_jobs([(load_index, (index_id,),
+                           dict(verbose=options['verbose'], force=options['force']))
+                          for index_id in large_ids + index_ids],
+                         options['local_workers'],
+                         describe=lambda job: filenames[job[1][0]])
+                return
+
+            if options['pipeline']:
+                batch_size = 1
+                queues = [stage.queue for stage in STAGES]
+            else:
+                batch_size = max(1, options['batch_size'])
+                queues = [getattr(settings, 'CELERY_DEFAULT_QUEUE', 'celery'), LARGE_QUEUE]
+            # Large filings go one per task to the large queue, the rest in
+            # batches to the general pool.
+            batches = [([index_id], True) for index_id in large_ids]
+            batches += [(index_ids[i:i + batch_size], False)
+                        for i in range(0, len(index_ids), batch_size)]
+            if options['pipeline']:
+                # Resume each filing after the last stage it completed.
+                statuses = dict(q.values_list('id', 'status'))
+            window = max(1, options['window'])
+            pending = []
+            queued = 0
+            try:
+                for batch, large in batches:
+                    self.wait_for_window(pending, queues, window)
+                    if options['pipeline']:
+                        pending.append(import_attrs_pipeline(
+                            batch[0], verbose=options['verbose'], large=large,
+                            status=statuses[batch[0]], force=options['force']).delay())
+                    elif large:
+                        pending.append(import_attrs_batch.apply_async(
+                            (batch,), dict(verbose=options['verbose'], force=options['force']),
+                            queue=LARGE_QUEUE))
+                    else:
+                        pending.append(import_attrs_batch.delay(
+                            batch, verbose=options['verbose'], force=options['force']))
+                    queued += len(batch)
+                    print_progress('Queued', queued, total_count)
+            except KeyboardInterrupt:
+                print>>sys.stderr, ('Interrupted after queueing %s of %s filings. Loaded filings '
+                                    'are skipped when run again without --force.') % (queued, total_count)
 
         except Exception, e:
             ferr = StringIO()
@@ -1,6 +1,8 @@
 #from optparse import make_option
 from datetime import date, timedelta
 
+from django_stocks.index_parsers import DEFAULT_SOURCE, INDEX_SOURCES
+from django_stocks.local import run_jobs
 from django_stocks.tasks import get_filing_list
 
 from django.core.management.base import BaseCommand
@@ -32,6 +34,16 @@ class Command(BaseCommand):
                             type=int,
                             help='The number of days to automatically '
                                  'redownload and reprocess index files.')
+        parser.add_argument('--source',
+                            default=DEFAULT_SOURCE,
+                            choices=sorted(INDEX_SOURCES),
+                            help='The quarterly index to read filings from. '
+                                 '"xbrl" only lists filings with XBRL data.')
+        parser.add_argument('--local-workers',
+                            default=0,
+                            type=int,
+                            help='Import in this many local processes instead of '
+                                 'queueing Celery tasks.')
         #help = ("Download new files representing one month of 990s, "
         #        "ignoring months we already have. Each quarter contains hundreds "
         #        "of thousands of filings; will take a while to run.")
@@ -42,6 +54,7 @@ class Command(BaseCommand):
         if target_quarter:
             target_quarter = int(target_quarter)
 
+        jobs = []
         for year in range(options['start_year'], options['end_year']):
             for quarter in range(4):
                 if target_quarter and quarter+1 != target_quarter:
@@ -50,4 +63,12 @@ class Command(BaseCommand):
                 reprocess_date = (quarter_start >
                         (date.today() - timedelta(days=reprocess_n_days)))
                 _reprocess = (reprocess or reprocess_date)
-                get_filing_list.delay(year, quarter+1, reprocess=_reprocess)
+                if options['local_workers']:
+                    jobs.append((get_filing_list, (year, quarter+1),
+                                 dict(reprocess=_reprocess, source=options['source'])))
+                    continue
+                get_filing_list.delay(year, quarter+1, reprocess=_reprocess,
+                                      source=options['source'])
+        if jobs:
+            run_jobs(jobs, options['local_workers'],
+                     describe=lambda job: '%s Q%s' % job[1])
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from django_stocks.celery import app
+from django_stocks.routing import STAGES, queue_depth, worker_command
+
+
+class Command(BaseCommand):
+    help = 'Shows the messages waiting in each stage of the import pipeline.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--commands',
+                            action='store_true',
+                            default=False,
+                            help='Also show the command to start the workers of each stage.')
+
+    def handle(self, *args, **options):
+        for stage in STAGES:
+            depth = queue_depth(app, stage.queue)
+            if depth is None:
+                self.stdout.write('%-8s %-25s not declared' % (stage.name, stage.queue))
+            else:
+                self.stdout.write('%-8s %-25s %8d messages %4d consumers' % (
+                    (stage.name, stage.queue) + tuple(depth)))
+            if options['commands']:
+                self.stdout.write('    ' + worker_command(stage))
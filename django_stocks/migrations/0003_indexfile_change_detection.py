@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 05:10
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_stocks', '0002_auto_20160222_2207'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='indexfile',
+            name='content_hash',
+            field=models.CharField(blank=True, help_text='SHA1 of the uncompressed index as last processed.', max_length=40, null=True),
+        ),
+        migrations.AddField(
+            model_name='indexfile',
+            name='etag',
+            field=models.CharField(blank=True, help_text='The ETag header sent with the index as last processed.', max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='indexfile',
+            name='last_modified',
+            field=models.CharField(blank=True, help_text='The Last-Modified header sent with the index as last processed.', max_length=50, null=True),
+        ),
+        migrations.AddField(
+            model_name='indexfile',
+            name='line_count',
+            field=models.IntegerField(blank=True, help_text='Number of lines in the index as last processed.', null=True),
+        ),
+        migrations.AddField(
+            model_name='indexfile',
+            name='size',
+            field=models.BigIntegerField(blank=True, help_text='Size in bytes of the uncompressed index as last processed.', null=True),
+        ),
+    ]
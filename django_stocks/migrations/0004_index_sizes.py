@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 05:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_stocks', '0003_indexfile_change_detection'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='index',
+            name='instance_size',
+            field=models.BigIntegerField(blank=True, help_text='Uncompressed size in bytes of the XBRL instance document, once known.', null=True),
+        ),
+        migrations.AddField(
+            model_name='index',
+            name='xbrl_size',
+            field=models.BigIntegerField(blank=True, help_text='Size in bytes of the XBRL archive, once known.', null=True),
+        ),
+    ]
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 05:42
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def set_status(apps, schema_editor):
+    # Filings and quarters imported before statuses were recorded.
+    Index = apps.get_model('django_stocks', 'Index')
+    IndexFile = apps.get_model('django_stocks', 'IndexFile')
+    Index.objects.filter(attributes_loaded=True).update(status='loaded')
+    Index.objects.filter(attributes_loaded=False, valid=False).update(status='failed')
+    IndexFile.objects.filter(complete__isnull=False).update(status='loaded')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_stocks', '0004_index_sizes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='index',
+            name='download_seconds',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='index',
+            name='downloaded',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='index',
+            name='failed',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='index',
+            name='load_seconds',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='index',
+            name='loaded',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='index',
+            name='parse_seconds',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='index',
+            name='parsed',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='index',
+            name='status',
+            field=models.CharField(choices=[(b'pending', b'pending'), (b'downloaded', b'downloaded'), (b'parsed', b'parsed'), (b'loaded', b'loaded'), (b'failed', b'failed')], db_index=True, default=b'pending', help_text='How far the last import got.', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='indexfile',
+            name='download_seconds',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='indexfile',
+            name='failed',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='indexfile',
+            name='load_seconds',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='indexfile',
+            name='loaded',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='indexfile',
+            name='parse_seconds',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='indexfile',
+            name='parsed',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='indexfile',
+            name='status',
+            field=models.CharField(choices=[(b'pending', b'pending'), (b'downloaded', b'downloaded'), (b'parsed', b'parsed'), (b'loaded', b'loaded'), (b'failed', b'failed')], db_index=True, default=b'pending', help_text='How far the last import got.', max_length=20),
+        ),
+        migrations.RunPython(set_status, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 05:44
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_stocks', '0005_import_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='index',
+            name='claim_expires',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='index',
+            name='claimed_by',
+            field=models.CharField(blank=True, help_text='The worker importing this, while its claim lasts.', max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='indexfile',
+            name='claim_expires',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='indexfile',
+            name='claimed_by',
+            field=models.CharField(blank=True, help_text='The worker importing this, while its claim lasts.', max_length=100, null=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 05:55
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_stocks', '0006_import_claims'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='indexfile',
+            name='error',
+            field=models.TextField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 06:07
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_stocks', '0007_indexfile_error'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='indexfile',
+            name='content_hash',
+            field=models.CharField(blank=True, help_text='SHA1 of the data lines of the index as last processed.', max_length=40, null=True),
+        ),
+        migrations.AlterField(
+            model_name='indexfile',
+            name='line_count',
+            field=models.IntegerField(blank=True, help_text='Number of data lines in the index as last processed.', null=True),
+        ),
+        migrations.AlterField(
+            model_name='indexfile',
+            name='size',
+            field=models.BigIntegerField(blank=True, help_text='Size in bytes of the data lines of the index as last processed.', null=True),
+        ),
+    ]
@@ -1,16 +1,51 @@
+from collections import Counter
+from contextlib import contextmanager
+from datetime import timedelta
+import errno
 import os
+import socket
 import sys
+import uuid
 import zipfile
 
 from django.conf import settings
-from django.db import models
-from django.db.models import Min, Max
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, Count, F, Min, Max, Q, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from django.utils.translation import ugettext, ugettext_lazy as _
 
-from django_stocks import xbrl
+from django_stocks import remotezip, xbrl
+from django_stocks.fetchers import FetchError, get_fetcher
 
 import constants as c
-from settings import DATA_DIR
+from settings import CLAIM_LEASE, DATA_DIR, RANGE_DOWNLOADS, XBRL_CACHE, XBRL_STREAMING
+
+# Name of the parsed instance saved next to each filing's downloaded files.
+XBRL_CACHE_NAME = 'instance.parsed'
+
+# Number of values inserted per savepoint by AttributeValue.bulk_load().
+BULK_CHUNK_SIZE = 1000
+
+# Maximum number of values passed in a single ``IN (...)`` lookup.
+LOOKUP_CHUNK_SIZE = 900
+
+# How many times a chunk of values that collided with another worker's is
+# checked and inserted again before giving up.
+INSERT_ATTEMPTS = 3
+
+
+def makedirs(path):
+    """
+    Creates `path` and any missing parents, tolerating another thread or
+    process creating it at the same time.
+    """
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST or not os.path.isdir(path):
+            raise
+
 
 class Namespace(models.Model):
     """
@@ -76,17 +111,49 @@ class Attribute(models.Model):
     def __unicode__(self):
         return '%s' % (self.name)
     
+    @classmethod
+    def add_values(cls, counts):
+        """
+        Adds the number of values just inserted for each attribute, given
+        as a dict of attribute id to count, to total_values.
+
+        Every loader updates the same popular attributes, so the rows are
+        updated in ascending id order, which keeps concurrent loaders from
+        deadlocking on each other. Call it in its own short transaction
+        once the values are committed, so the rows are not held locked
+        for the whole load.
+        """
+        ids = sorted(counts)
+        for i in range(0, len(ids), LOOKUP_CHUNK_SIZE):
+            chunk = ids[i:i + LOOKUP_CHUNK_SIZE]
+            cls.objects.filter(id__in=chunk).update(
+                total_values=Coalesce(F('total_values'), 0) + Case(
+                    *[When(id=attribute_id, then=Value(counts[attribute_id])) for attribute_id in chunk],
+                    output_field=models.IntegerField()))
+
     @classmethod
     def do_update(cls, *args, **kwargs):
-        q = cls.objects.filter(total_values_fresh=False).only('id', 'name')
-        total = q.count()
-        i = 0
-        for r in q.iterator():
-            i += 1
-            total_values = AttributeValue.objects.filter(attribute__name=r.name).count()
-            cls.objects.filter(id=r.id).update(
-                total_values=total_values,
-                total_values_fresh=True)
+        """
+        Recounts every attribute's values with a single GROUP BY and
+        corrects the totals that have drifted, e.g. after values were
+        deleted, marking all of them fresh.
+
+        Values inserted while this runs may be counted twice or not at
+        all, so it is best run while no imports are.
+        """
+        counts = dict(
+            AttributeValue.objects.order_by().values_list('attribute_id').annotate(n=Count('id')))
+        changes = {}
+        for id, total_values, fresh in cls.objects.values_list('id', 'total_values', 'total_values_fresh'):
+            n = counts.get(id, 0)
+            if total_values != n or not fresh:
+                changes.setdefault(n, []).append(id)
+        for n, ids in changes.iteritems():
+            for i in range(0, len(ids), LOOKUP_CHUNK_SIZE):
+                cls.objects.filter(id__in=ids[i:i + LOOKUP_CHUNK_SIZE]).update(
+                    total_values=n,
+                    total_values_fresh=True)
+        return sum(map(len, changes.itervalues()))
 
 
 class AttributeValue(models.Model):
@@ -138,7 +205,177 @@ class AttributeValue(models.Model):
             self.start_date,
         )
 
-class IndexFile(models.Model):
+    @classmethod
+    def existing_keys(cls, company_id, values):
+        """
+        Returns the (attribute_id, start_date, end_date) keys of the stored
+        values of a company that match any of `values`, using one query
+        over their range of start dates per chunk of attributes.
+        """
+        starts = [value.start_date for value in values]
+        attribute_ids = sorted(set(value.attribute_id for value in values))
+        keys = set()
+        for i in range(0, len(attribute_ids), LOOKUP_CHUNK_SIZE):
+            q = cls.objects.filter(
+                company_id=company_id,
+                attribute_id__in=attribute_ids[i:i + LOOKUP_CHUNK_SIZE],
+                start_date__gte=min(starts),
+                start_date__lte=max(starts))
+            keys.update(q.values_list('attribute_id', 'start_date', 'end_date'))
+        return keys
+
+    @classmethod
+    def bulk_load(cls, company_id, values, chunk_size=BULK_CHUNK_SIZE):
+        """
+        Inserts the unsaved `values` of a company, skipping any whose
+        attribute and dates are already stored. Must be called in a
+        transaction.
+
+        The company's row is locked first, so loads of the same company
+        are serialised until the transaction ends. The unique constraint
+        cannot keep them apart by itself, since instants have no end date
+        and NULLs never compare equal. Existing keys are then read up front
+        and the rest are inserted in chunks, each in its own savepoint. A
+        chunk that still collides with a value inserted outside the lock
+        is checked again, up to INSERT_ATTEMPTS times.
+
+        Returns the number of values inserted for each attribute id, to
+        be passed to Attribute.add_values() once committed, and the number
+        of values skipped.
+        """
+        if not values:
+            return Counter(), 0
+        Company.objects.select_for_update().get(pk=company_id)
+        existing = cls.existing_keys(company_id, values)
+        pending = []
+        for value in values:
+            key = (value.attribute_id, value.start_date, value.end_date)
+            if key not in existing:
+                existing.add(key)
+                pending.append(value)
+        counts = Counter()
+        for i in range(0, len(pending), chunk_size):
+            chunk = pending[i:i + chunk_size]
+            for attempt in range(INSERT_ATTEMPTS):
+                try:
+                    with transaction.atomic():
+                        cls.objects.bulk_create(chunk)
+                    break
+                except IntegrityError:
+                    if attempt == INSERT_ATTEMPTS - 1:
+                        raise
+                    existing = cls.existing_keys(company_id, chunk)
+                    chunk = [value for value in chunk
+                             if (value.attribute_id, value.start_date, value.end_date) not in existing]
+            counts.update(value.attribute_id for value in chunk)
+        return counts, len(values) - sum(counts.values())
+
+
+class ImportStatus(models.Model):
+    """
+    The import status of a filing or quarterly index, with when it last
+    reached each status and how long the step that got it there took,
+    and the claim of the worker importing it, if any.
+    """
+    
+    # The fields recording when each status was reached and how long the
+    # step took.
+    STATUS_FIELDS = {
+        c.PENDING: (None, None),
+        c.DOWNLOADED: ('downloaded', 'download_seconds'),
+        c.PARSED: ('parsed', 'parse_seconds'),
+        c.LOADED: ('loaded', 'load_seconds'),
+        c.FAILED: ('failed', None),
+    }
+    
+    status = models.CharField(
+        max_length=20,
+        choices=[(status, status) for status in c.STATUSES],
+        default=c.PENDING,
+        db_index=True,
+        help_text=_('How far the last import got.'))
+    
+    downloaded = models.DateTimeField(blank=True, null=True)
+    download_seconds = models.FloatField(blank=True, null=True)
+    parsed = models.DateTimeField(blank=True, null=True)
+    parse_seconds = models.FloatField(blank=True, null=True)
+    loaded = models.DateTimeField(blank=True, null=True)
+    load_seconds = models.FloatField(blank=True, null=True)
+    failed = models.DateTimeField(blank=True, null=True)
+    
+    error = models.TextField(blank=True, null=True)
+    
+    claimed_by = models.CharField(
+        max_length=100,
+        blank=True,
+        null=True,
+        help_text=_('The worker importing this, while its claim lasts.'))
+    
+    claim_expires = models.DateTimeField(blank=True, null=True)
+    
+    class Meta:
+        abstract = True
+    
+    def claim(self, lease=None):
+        """
+        Claims this for the next `lease` seconds, unless another claim has
+        yet to expire. The check and the claim are a single UPDATE, so only
+        one of several workers racing for it wins.
+
+        Returns True if the claim was won.
+        """
+        now = timezone.now()
+        owner = '%s:%d:%s' % (socket.gethostname()[:60], os.getpid(), uuid.uuid4().hex[:16])
+        expires = now + timedelta(seconds=CLAIM_LEASE if lease is None else lease)
+        won = type(self).objects\
+            .filter(id=self.id)\
+            .filter(Q(claim_expires__isnull=True) | Q(claim_expires__lte=now))\
+            .update(claimed_by=owner, claim_expires=expires)
+        if won:
+            self.claimed_by = owner
+            self.claim_expires = expires
+        return bool(won)
+    
+    def release(self):
+        """
+        Gives up this worker's claim, unless it expired and was taken over.
+        """
+        type(self).objects\
+            .filter(id=self.id, claimed_by=self.claimed_by)\
+            .update(claimed_by=None, claim_expires=None)
+        self.claimed_by = None
+        self.claim_expires = None
+    
+    @contextmanager
+    def claimed(self, lease=None):
+        """
+        Claims this for the duration of the block, yielding whether the
+        claim was won. The block should do nothing if it was not.
+        """
+        won = self.claim(lease)
+        try:
+            yield won
+        finally:
+            if won:
+                self.release()
+    
+    def set_status(self, status, seconds=None, **fields):
+        """
+        Records that this reached `status` now, after a step of `seconds`,
+        saving it in a single UPDATE along with any other `fields`.
+        """
+        stamp, duration = self.STATUS_FIELDS[status]
+        fields['status'] = status
+        if stamp:
+            fields[stamp] = timezone.now()
+        if duration and seconds is not None:
+            fields[duration] = seconds
+        for name, value in fields.items():
+            setattr(self, name, value)
+        type(self).objects.filter(id=self.id).update(**fields)
+
+
+class IndexFile(ImportStatus):
     
     year = models.IntegerField(
         blank=False,
@@ -151,9 +388,36 @@ class IndexFile(models.Model):
         db_index=True)
     
     filename = models.CharField(max_length=200, blank=False, null=False)
-    downloaded = models.DateTimeField(blank=True, null=True)
     complete = models.DateTimeField(blank=True, null=True)
-    
+
+    content_hash = models.CharField(
+        max_length=40,
+        blank=True,
+        null=True,
+        help_text=_('SHA1 of the data lines of the index as last processed.'))
+
+    size = models.BigIntegerField(
+        blank=True,
+        null=True,
+        help_text=_('Size in bytes of the data lines of the index as last processed.'))
+
+    line_count = models.IntegerField(
+        blank=True,
+        null=True,
+        help_text=_('Number of data lines in the index as last processed.'))
+
+    last_modified = models.CharField(
+        max_length=50,
+        blank=True,
+        null=True,
+        help_text=_('The Last-Modified header sent with the index as last processed.'))
+
+    etag = models.CharField(
+        max_length=100,
+        blank=True,
+        null=True,
+        help_text=_('The ETag header sent with the index as last processed.'))
+
     class Meta:
         ordering = ('-year', 'quarter')
         unique_together = (('year', 'quarter'),)
@@ -230,7 +494,18 @@ class Company(models.Model):
 #                pass
 #        super(Company, self).save(*args, **kwargs)
     
-class Index(models.Model):
+class Index(ImportStatus):
+    """
+    A filing listed in an EDGAR quarterly index.
+
+    The methods that touch the filing's files on disk (localfile,
+    localpath, html, download, xbrl_localpath, xbrl) only use absolute
+    paths below DATA_DIR and never change the working directory, so they
+    may be called concurrently from any number of threads or greenlets,
+    e.g. under Celery's threads, eventlet or gevent pools. Concurrent
+    downloads of the same filing each write to their own temporary file
+    and atomically rename it into place.
+    """
     company = models.ForeignKey(
         'Company',
         related_name='filings')
@@ -273,7 +548,15 @@ class Index(models.Model):
         db_index=True,
         help_text=_('If false, errors were encountered trying to parse the associated files.'))
     
-    error = models.TextField(blank=True, null=True)
+    xbrl_size = models.BigIntegerField(
+        blank=True,
+        null=True,
+        help_text=_('Size in bytes of the XBRL archive, once known.'))
+    
+    instance_size = models.BigIntegerField(
+        blank=True,
+        null=True,
+        help_text=_('Uncompressed size in bytes of the XBRL instance document, once known.'))
     
     class Meta:
         verbose_name_plural = _('indices')
@@ -302,13 +585,13 @@ class Index(models.Model):
         return self.filename.split('/')[-1]
         
     def localfile(self):
-        filename = '%s/%s/%s/%s' % (DATA_DIR, self.company.cik,self.txt()[:-4],self.txt())
+        filename = os.path.join(self.localpath(), self.txt())
         if os.path.exists(filename):
             return filename
         return None
         
     def localpath(self):
-        return '%s/%s/%s/' % (DATA_DIR, self.company.cik, self.txt()[:-4])
+        return os.path.join(DATA_DIR, str(self.company_id), self.txt()[:-4])
 
     #def localcik(self):
     #    return '%s/%s/' % (DATA_DIR, self.company.cik)
@@ -326,16 +609,22 @@ class Index(models.Model):
             return f
 
     def download(self, verbose=False):
+        """
+        Downloads the filing's XBRL instance document unless it is already
+        on disk. With RANGE_DOWNLOADS only the instance is fetched from the
+        remote archive, otherwise the whole archive is saved.
+
+        Returns True if the instance is available locally. If the download
+        fails the error is saved on this index, and it is marked invalid
+        when the failure is permanent, e.g. the archive does not exist.
+        """
         
         #d = self.localcik()
         #if not os.path.isdir(d):
         #    os.makedirs(d)
             
         d = self.localpath()
-        if not os.path.isdir(d):
-            os.makedirs(d)
-            
-        os.chdir(self.localpath())
+        makedirs(d)
         
         html_link = self.html_link()
         xbrl_link = self.xbrl_link()
@@ -343,34 +632,140 @@ class Index(models.Model):
             print 'html_link:',
             print 'xbrl_link:',xbrl_link
             
-        if xbrl_link:
-            if not os.path.exists(xbrl_link.split('/')[-1]):
-                if verbose:
-                    os.system('wget %s' % xbrl_link)
-                else:
-                    os.system('wget --quiet %s' % xbrl_link)
-
-    def xbrl_localpath(self):
+        if not xbrl_link:
+            self.valid = False
+            self.error = 'No XBRL found.'
+            type(self).objects.filter(id=self.id).update(valid=self.valid, error=self.error)
+            return False
+        fn = os.path.join(d, xbrl_link.split('/')[-1])
+        if self.xbrl_localpath(download=False)[0]:
+            if self.instance_size is None:
+                self.record_sizes()
+            return True
+        archive_size = None
         try:
-            os.chdir(self.localpath())
-        except:
+            fetched = False
+            if RANGE_DOWNLOADS:
+                try:
+                    _, archive_size = remotezip.fetch_instance(get_fetcher(), xbrl_link, d, fn)
+                    fetched = True
+                except remotezip.RemoteZipError as e:
+                    if verbose:
+                        print 'Falling back to a full download:', e
+            if not fetched:
+                get_fetcher().download(xbrl_link, fn)
+        except FetchError as e:
+            if verbose:
+                print e
+            self.error = 'Download failed: %s' % e
+            if not e.transient:
+                self.valid = False
+            type(self).objects.filter(id=self.id).update(valid=self.valid, error=self.error)
+            return False
+        self.record_sizes(archive_size)
+        return True
+
+    def fetch_size(self):
+        """
+        Records the size of the filing's XBRL archive from a HEAD request,
+        without downloading it. Returns the size, or None if it could not
+        be found.
+        """
+        xbrl_link = self.xbrl_link()
+        if not xbrl_link:
+            return None
+        try:
+            with get_fetcher().open(xbrl_link, method='HEAD') as response:
+                size = response.headers.get('content-length')
+        except FetchError:
+            return None
+        if size is None:
+            return None
+        self.xbrl_size = int(size)
+        type(self).objects.filter(id=self.id).update(xbrl_size=self.xbrl_size)
+        return self.xbrl_size
+
+    def record_sizes(self, archive_size=None):
+        """
+        Records the sizes of the downloaded archive, or `archive_size` if
+        only the instance was fetched from it, and of the instance.
+        """
+        filepath, open_method = self.xbrl_localpath(download=False)
+        if not filepath:
+            return
+        if open_method:
+            # A member of the downloaded archive.
+            d = self.localpath()
+            archive = [elem for elem in sorted(os.listdir(d)) if elem.endswith('.zip')][0]
+            archive_size = os.path.getsize(os.path.join(d, archive))
+            with zipfile.ZipFile(os.path.join(d, archive)) as zf:
+                instance_size = zf.getinfo(filepath).file_size
+        else:
+            instance_size = os.path.getsize(filepath)
+        sizes = {'instance_size': instance_size}
+        if archive_size is not None:
+            sizes['xbrl_size'] = archive_size
+        for name, value in sizes.items():
+            setattr(self, name, value)
+        type(self).objects.filter(id=self.id).update(**sizes)
+
+    def xbrl_localpath(self, download=True):
+        """
+        Returns the XBRL instance document's path and a function to open
+        it with, or (None, None).
+
+        The instance is either a member of the downloaded archive, opened
+        with the archive's open method, or a file extracted on its own by
+        a range download, opened directly.
+        """
+        d = self.localpath()
+        if not os.path.isdir(d) and download:
             self.download()
-        files = os.listdir('.')
-        archives = [elem for elem in files if elem.endswith('.zip')]
-        if not archives:
+        if not os.path.isdir(d):
             return None, None
-        zf = zipfile.ZipFile(archives[0])
-        xml = sorted([elem for elem in zf.namelist() if elem.endswith('.xml')], key=len)
-        if not len(xml):
+        files = sorted(os.listdir(d))
+        archives = [elem for elem in files if elem.endswith('.zip')]
+        if archives:
+            zf = zipfile.ZipFile(os.path.join(d, archives[0]))
+            xml = remotezip.instance_member(zf.namelist())
+            if not xml:
+                return None, None
+            return xml, zf.open
+        xml = remotezip.instance_member(files)
+        if not xml:
             return None, None
-        return xml[0], zf.open
+        return os.path.join(d, xml), None
+
+    def xbrl_cachefile(self):
+        """
+        Returns the path of the parsed instance saved next to the
+        downloaded files if it is newer than all of them, else None.
+        """
+        d = self.localpath()
+        fn = os.path.join(d, XBRL_CACHE_NAME)
+        if not os.path.isfile(fn):
+            return None
+        sources = [os.path.join(d, elem) for elem in os.listdir(d) if elem.endswith(('.zip', '.xml'))]
+        if not sources or max(map(os.path.getmtime, sources)) > os.path.getmtime(fn):
+            return None
+        return fn
 
     def xbrl(self):
+        if XBRL_CACHE:
+            fn = self.xbrl_cachefile()
+            if fn:
+                try:
+                    return xbrl.XBRL.load(fn)
+                except ValueError:
+                    # Written by an older parser, parse it again.
+                    pass
         filepath, open_method = self.xbrl_localpath()
         if not filepath:
             print 'no xbrl found. this option is for 10-ks.'
             return
-        x = xbrl.XBRL(filepath, opener=open_method)
+        x = xbrl.XBRL(filepath, opener=open_method, streaming=XBRL_STREAMING)
+        if XBRL_CACHE:
+            x.save(os.path.join(self.localpath(), XBRL_CACHE_NAME))
         #x.fields['FiscalPeriod'] = x.fields['DocumentFiscalPeriodFocus']
         #x.fields['FiscalYear'] = x.fields['DocumentFiscalYearFocus']
         #x.fields['SECFilingPage'] = self.index_link()
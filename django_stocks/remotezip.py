@@ -0,0 +1,228 @@
+"""
+Extracts single members of remote ZIP archives using HTTP Range requests.
+
+EDGAR's -xbrl.zip archives bundle the instance document with its schema
+and linkbases, which are several times larger and never read. Reading the
+archive's central directory from the end of the file lets us request only
+the compressed bytes of the instance.
+"""
+import os
+import re
+import struct
+import zlib
+
+from django_stocks.fetchers import CHUNK_SIZE, FetchError, atomic_write, save_response
+
+# End of central directory record, minus the trailing comment.
+EOCD = struct.Struct('<4s4H2LH')
+EOCD_SIGNATURE = 'PK\x05\x06'
+
+# The EOCD record sits in the last 22 bytes plus up to 64KB of comment.
+# EDGAR archives carry no comment, so a smaller tail is tried first; it
+# usually holds the whole central directory as well.
+MAX_TAIL_SIZE = EOCD.size + 0xFFFF
+TAIL_SIZE = 8 * 1024
+
+CENTRAL_HEADER = struct.Struct('<4s6H3L5H2L')
+CENTRAL_SIGNATURE = 'PK\x01\x02'
+
+LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+LOCAL_SIGNATURE = 'PK\x03\x04'
+
+# Extra bytes requested after a member in case its local header carries a
+# longer extra field than the central directory reports.
+LOCAL_EXTRA_SLACK = 1024
+
+STORED = 0
+DEFLATED = 8
+
+
+class RemoteZipError(ValueError):
+    """
+    Raised when an archive cannot be read with range requests, e.g. it
+    uses ZIP64 or an unsupported compression method.
+    """
+
+
+class ZipMember(object):
+    __slots__ = ('name', 'method', 'crc', 'compressed_size', 'size', 'offset', 'extra_length')
+
+    def __init__(self, name, method, crc, compressed_size, size, offset, extra_length):
+        self.name = name
+        self.method = method
+        self.crc = crc
+        self.compressed_size = compressed_size
+        self.size = size
+        self.offset = offset
+        self.extra_length = extra_length
+
+
+def instance_member(names):
+    """
+    Returns the name of the XBRL instance document among an archive's
+    member names, the shortest .xml name, or None.
+    """
+    xml = sorted([name for name in names if name.endswith('.xml')], key=len)
+    if xml:
+        return xml[0]
+    return None
+
+
+def content_range_total(response):
+    """
+    Returns the full size of the resource from a 206 response.
+    """
+    match = re.match(r'bytes \d+-\d+/(\d+)', response.headers.get('content-range', ''))
+    if not match:
+        raise RemoteZipError('Missing Content-Range in response for %s' % response.url)
+    return int(match.group(1))
+
+
+def read_exactly(fileobj, size):
+    data = fileobj.read(size)
+    if len(data) != size:
+        raise FetchError(getattr(fileobj, 'url', ''), reason='Short read')
+    return data
+
+
+class RemoteZip(object):
+    """
+    A remote ZIP archive read with Range requests through a fetcher.
+    Each request is retried like the fetcher's own downloads when it fails
+    with a transient error.
+    """
+
+    def __init__(self, fetcher, url):
+        self.fetcher = fetcher
+        self.url = url
+
+    def fetch_range(self, start, end):
+        """
+        Returns bytes start..end (inclusive) of the archive.
+        """
+        def fetch_range():
+            with self.fetcher.open(self.url, headers={'Range': 'bytes=%d-%d' % (start, end)}) as response:
+                if response.status != 206:
+                    raise RemoteZipError('Range request ignored for %s' % self.url)
+                return response.read()
+        return self.fetcher._retry(self.url, fetch_range)
+
+    def members(self, tail, tail_start):
+        """
+        Parses the central directory, given the last bytes of the archive
+        starting at offset `tail_start`.
+        """
+        pos = tail.rfind(EOCD_SIGNATURE)
+        if pos < 0 and tail_start > 0 and len(tail) < MAX_TAIL_SIZE:
+            # A long archive comment, widen the search.
+            end = tail_start + len(tail) - 1
+            tail_start = max(0, end + 1 - MAX_TAIL_SIZE)
+            tail = self.fetch_range(tail_start, end)
+            pos = tail.rfind(EOCD_SIGNATURE)
+        if pos < 0 or len(tail) - pos < EOCD.size:
+            raise RemoteZipError('No end of central directory record in %s' % self.url)
+        _, _, _, _, count, cd_size, cd_offset, _ = EOCD.unpack(tail[pos:pos + EOCD.size])
+        if cd_offset == 0xFFFFFFFF or count == 0xFFFF:
+            raise RemoteZipError('ZIP64 archives are not supported: %s' % self.url)
+        if cd_offset >= tail_start:
+            directory = tail[cd_offset - tail_start:cd_offset - tail_start + cd_size]
+        else:
+            directory = self.fetch_range(cd_offset, cd_offset + cd_size - 1)
+
+        members = []
+        pos = 0
+        for _ in range(count):
+            header = directory[pos:pos + CENTRAL_HEADER.size]
+            if len(header) != CENTRAL_HEADER.size or header[:4] != CENTRAL_SIGNATURE:
+                raise RemoteZipError('Corrupt central directory in %s' % self.url)
+            (_, _, _, flags, method, _, _, crc, compressed_size, size,
+             name_length, extra_length, comment_length, _, _, _, offset) = CENTRAL_HEADER.unpack(header)
+            pos += CENTRAL_HEADER.size
+            name = directory[pos:pos + name_length]
+            pos += name_length + extra_length + comment_length
+            members.append(ZipMember(name, method, crc, compressed_size, size, offset, extra_length))
+        return members
+
+    def extract(self, member, fn, total_size):
+        """
+        Fetches and decompresses a single member into `fn`.
+        """
+        if member.method not in (STORED, DEFLATED):
+            raise RemoteZipError('Unsupported compression method %s in %s' % (member.method, self.url))
+        start = member.offset
+        end = min(total_size, start + LOCAL_HEADER.size + len(member.name)
+                  + member.extra_length + member.compressed_size + LOCAL_EXTRA_SLACK) - 1
+        headers = {'Range': 'bytes=%d-%d' % (start, end)}
+        self.fetcher._retry(self.url, lambda: self._extract(member, fn, headers, end - start + 1))
+
+    def _extract(self, member, fn, headers, length):
+        """
+        Makes one attempt at extract(), requesting `length` bytes.
+        """
+        with atomic_write(fn) as fileout:
+            with self.fetcher.open(self.url, headers=headers) as response:
+                if response.status != 206:
+                    raise RemoteZipError('Range request ignored for %s' % self.url)
+                header = read_exactly(response, LOCAL_HEADER.size)
+                if header[:4] != LOCAL_SIGNATURE:
+                    raise RemoteZipError('Bad local header for %s in %s' % (member.name, self.url))
+                name_length, extra_length = LOCAL_HEADER.unpack(header)[-2:]
+                if LOCAL_HEADER.size + name_length + extra_length + member.compressed_size > length:
+                    raise RemoteZipError('Local header of %s in %s is too large' % (member.name, self.url))
+                read_exactly(response, name_length + extra_length)
+
+                decompressor = None
+                if member.method == DEFLATED:
+                    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+                crc = 0
+                size = 0
+                remaining = member.compressed_size
+                while remaining:
+                    data = read_exactly(response, min(CHUNK_SIZE, remaining))
+                    remaining -= len(data)
+                    if decompressor:
+                        data = decompressor.decompress(data)
+                        if not remaining:
+                            data += decompressor.flush()
+                    crc = zlib.crc32(data, crc)
+                    size += len(data)
+                    fileout.write(data)
+                # Drain the slack so the connection can be reused.
+                response.read()
+            if size != member.size or (crc & 0xFFFFFFFF) != member.crc:
+                raise FetchError(self.url, reason='Checksum mismatch extracting %s' % member.name)
+
+
+def fetch_instance(fetcher, url, directory, archive_fn):
+    """
+    Saves the XBRL instance document of the remote archive at `url` into
+    `directory`, fetching only the bytes needed with Range requests.
+
+    If the server ignores Range requests the whole archive is saved as
+    `archive_fn` instead, from the same response. Returns the path written
+    and the size of the remote archive. Raises RemoteZipError if the
+    archive cannot be read member by member, in which case the caller
+    should download it in full.
+    """
+    def fetch_tail():
+        with fetcher.open(url, headers={'Range': 'bytes=-%d' % TAIL_SIZE}) as response:
+            if response.status == 200:
+                save_response(response, archive_fn)
+                return None
+            if response.status != 206:
+                raise RemoteZipError('Unexpected status %s for %s' % (response.status, url))
+            return content_range_total(response), response.read()
+    fetched = fetcher._retry(url, fetch_tail)
+    if fetched is None:
+        return archive_fn, os.path.getsize(archive_fn)
+    total_size, tail = fetched
+
+    remote = RemoteZip(fetcher, url)
+    members = remote.members(tail, total_size - len(tail))
+    name = instance_member([member.name for member in members])
+    if name is None:
+        raise FetchError(url, 404, 'No XBRL instance in archive')
+    member = [member for member in members if member.name == name][0]
+    fn = os.path.join(directory, os.path.basename(name))
+    remote.extract(member, fn, total_size)
+    return fn, total_size
@@ -0,0 +1,44 @@
+"""
+Queues and worker settings of the download, parse and load stages of the
+import pipeline, and of the queue large filings are sent to.
+
+The stage tasks name their queue themselves, from the
+DJANGO_STOCKS_*_QUEUE settings, so no CELERY_ROUTES are needed.
+"""
+from collections import namedtuple
+import multiprocessing
+
+from django_stocks import settings
+
+Stage = namedtuple('Stage', 'name queue pool concurrency')
+
+STAGES = (
+    # Green threads, since downloads spend their time waiting on EDGAR.
+    Stage('download', settings.DOWNLOAD_QUEUE, 'eventlet', settings.DOWNLOAD_CONCURRENCY),
+    Stage('parse', settings.PARSE_QUEUE, 'prefork', settings.PARSE_CONCURRENCY or multiprocessing.cpu_count()),
+    Stage('load', settings.LOAD_QUEUE, 'prefork', settings.LOAD_CONCURRENCY),
+    # Filings of at least DJANGO_STOCKS_LARGE_FILING_SIZE, whole batches or
+    # the parse stage, kept apart so they do not hold up the small ones.
+    Stage('large', settings.LARGE_QUEUE, 'prefork', settings.LARGE_CONCURRENCY),
+)
+
+
+def worker_command(stage):
+    """
+    Returns the command that starts a worker for a stage.
+    """
+    return 'celery -A django_stocks worker -l INFO -Q %s -P %s -c %d -n %s@%%h' % (
+        stage.queue, stage.pool, stage.concurrency, stage.name)
+
+
+def queue_depth(app, queue):
+    """
+    Returns the number of messages waiting in a queue and the number of
+    workers consuming from it, or None if the broker does not know it.
+    """
+    with app.connection() as conn:
+        try:
+            _, messages, consumers = conn.default_channel.queue_declare(queue=queue, passive=True)
+        except conn.channel_errors:
+            return None
+    return messages, consumers
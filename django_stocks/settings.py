@@ -1,3 +1,79 @@
+import os
+
 from django.conf import settings
 
-DATA_DIR = getattr(settings, 'django_stocks_DATA_DIR', '/tmp/django_stocks')
+# Always absolute, so that file paths do not depend on the working directory.
+DATA_DIR = os.path.abspath(getattr(settings, 'DJANGO_STOCKS_DATA_DIR',
+                                   getattr(settings, 'django_stocks_DATA_DIR', '/tmp/django_stocks')))
+
+# Dotted path of the class used to retrieve files from EDGAR.
+FETCHER = getattr(settings, 'DJANGO_STOCKS_FETCHER', 'django_stocks.fetchers.HTTPFetcher')
+
+# Root of a local EDGAR copy served by django_stocks.fetchers.MirrorFetcher.
+MIRROR_DIR = getattr(settings, 'DJANGO_STOCKS_MIRROR_DIR', os.path.join(DATA_DIR, 'mirror'))
+
+# The SEC asks automated clients to identify themselves.
+USER_AGENT = getattr(settings, 'DJANGO_STOCKS_USER_AGENT', 'django-stocks')
+
+# Socket timeout, in seconds, for HTTP requests to EDGAR.
+FETCH_TIMEOUT = getattr(settings, 'DJANGO_STOCKS_FETCH_TIMEOUT', 60)
+
+# Maximum EDGAR requests per second across all workers. The SEC's fair
+# access policy allows 10. Set to 0 to disable rate limiting.
+RATE_LIMIT = getattr(settings, 'DJANGO_STOCKS_RATE_LIMIT', 10)
+
+# Number of requests that may be sent back to back before the rate applies.
+RATE_LIMIT_BURST = getattr(settings, 'DJANGO_STOCKS_RATE_LIMIT_BURST', 1)
+
+# Where the shared rate limit state is kept: 'cache' for the default Django
+# cache, 'file' for a locked file under DATA_DIR (single host only), or
+# 'auto' to use the cache unless it is local to each process.
+RATE_LIMIT_BACKEND = getattr(settings, 'DJANGO_STOCKS_RATE_LIMIT_BACKEND', 'auto')
+
+# Number of idle keep-alive connections kept open per host.
+POOL_SIZE = getattr(settings, 'DJANGO_STOCKS_POOL_SIZE', 10)
+
+# How many times a failed download is retried, and the delay in seconds
+# before the first retry. The delay doubles on each further attempt.
+FETCH_RETRIES = getattr(settings, 'DJANGO_STOCKS_FETCH_RETRIES', 3)
+FETCH_BACKOFF = getattr(settings, 'DJANGO_STOCKS_FETCH_BACKOFF', 2.0)
+
+# If True, only the XBRL instance document is fetched from each filing's
+# archive using HTTP Range requests, falling back to downloading the whole
+# archive when the server does not support them.
+RANGE_DOWNLOADS = getattr(settings, 'DJANGO_STOCKS_RANGE_DOWNLOADS', True)
+
+# If True, XBRL instances are parsed incrementally, keeping only their
+# contexts, units and facts rather than the whole document tree.
+XBRL_STREAMING = getattr(settings, 'DJANGO_STOCKS_XBRL_STREAMING', True)
+
+# If True, each parsed XBRL instance is saved next to the filing's files
+# under DATA_DIR and reused until the files change or the parser does.
+XBRL_CACHE = getattr(settings, 'DJANGO_STOCKS_XBRL_CACHE', True)
+
+# Maximum number of namespace, attribute and unit ids each worker keeps
+# in memory, per table.
+LOOKUP_CACHE_SIZE = getattr(settings, 'DJANGO_STOCKS_LOOKUP_CACHE_SIZE', 20000)
+
+# Queues of the download, parse and load stages of the import pipeline,
+# and the number of tasks each stage's workers run at once. Downloads
+# mostly wait on the network, parsing is bound by CPU (None uses one
+# process per core) and loading is limited to protect the database.
+DOWNLOAD_QUEUE = getattr(settings, 'DJANGO_STOCKS_DOWNLOAD_QUEUE', 'django_stocks.download')
+PARSE_QUEUE = getattr(settings, 'DJANGO_STOCKS_PARSE_QUEUE', 'django_stocks.parse')
+LOAD_QUEUE = getattr(settings, 'DJANGO_STOCKS_LOAD_QUEUE', 'django_stocks.load')
+DOWNLOAD_CONCURRENCY = getattr(settings, 'DJANGO_STOCKS_DOWNLOAD_CONCURRENCY', 50)
+PARSE_CONCURRENCY = getattr(settings, 'DJANGO_STOCKS_PARSE_CONCURRENCY', None)
+LOAD_CONCURRENCY = getattr(settings, 'DJANGO_STOCKS_LOAD_CONCURRENCY', 2)
+
+# Filings whose XBRL archive is at least this many bytes are queued first
+# by sec_import_attrs, on their own queue, so the longest jobs start early
+# rather than holding up the end of an import. Set to 0 to disable.
+LARGE_FILING_SIZE = getattr(settings, 'DJANGO_STOCKS_LARGE_FILING_SIZE', 2 * 1024 * 1024)
+LARGE_QUEUE = getattr(settings, 'DJANGO_STOCKS_LARGE_QUEUE', 'django_stocks.large')
+LARGE_CONCURRENCY = getattr(settings, 'DJANGO_STOCKS_LARGE_CONCURRENCY', 2)
+
+# Seconds a worker's claim on a filing or quarterly index lasts, after
+# which another worker may take it over, e.g. once the first has died.
+# Must be longer than the slowest download, parse or load takes.
+CLAIM_LEASE = getattr(settings, 'DJANGO_STOCKS_CLAIM_LEASE', 60 * 60)
@@ -1,23 +1,45 @@
 from __future__ import absolute_import
 
-from datetime import date, datetime
-from functools import partial
 import os
-import re
 from StringIO import StringIO
 import sys
 import time
 import traceback
-import urllib
 from zipfile import ZipFile
 
-from celery import shared_task
-from django.db import DatabaseError
+from celery import chain, shared_task
+from celery.signals import task_prerun, task_postrun
+from celery.utils.log import get_task_logger
+from django.db import DatabaseError, OperationalError, transaction
 from django.utils import timezone
 from django.utils.encoding import force_text
 
+from django_stocks import constants as c, lookups
 from django_stocks.constants import MAX_QUANTIZE
-from django_stocks.models import Attribute, AttributeValue, Company, Index, IndexFile, Namespace, Unit, DATA_DIR
+from django_stocks.fetchers import FetchError, get_fetcher
+from django_stocks.index_parsers import DEFAULT_SOURCE, INDEX_SOURCES, HashingReader
+from django_stocks.models import Attribute, AttributeValue, Company, Index, IndexFile, DATA_DIR, LOOKUP_CHUNK_SIZE, makedirs
+from django_stocks.settings import DOWNLOAD_QUEUE, LARGE_QUEUE, LOAD_QUEUE, PARSE_QUEUE, XBRL_CACHE
+from django_stocks.throttle import get_governor
+
+logger = get_task_logger(__name__)
+
+
+# Rate limit wait recorded when each running task started.
+_task_throttle_wait = {}
+
+
+@task_prerun.connect
+def _record_throttle_wait(task_id=None, **kwargs):
+    _task_throttle_wait[task_id] = get_governor().thread_wait()
+
+
+@task_postrun.connect
+def _report_throttle_wait(task_id=None, task=None, **kwargs):
+    waited = get_governor().thread_wait() - _task_throttle_wait.pop(task_id, 0.0)
+    if waited:
+        logger.info('{0}[{1}] waited {2:.2f} seconds for EDGAR request tokens'.format(
+            task.name, task_id, waited))
 
 
 def print_progress(message,
@@ -44,75 +66,150 @@ def print_progress(message,
 
 
 @shared_task(max_retries=5, default_retry_delay=20)
-def get_filing_list(year, quarter, reprocess=False):
+def get_filing_list(year, quarter, reprocess=False, source=DEFAULT_SOURCE):
     """
     Gets the list of filings and download locations for the given
     year and quarter.
+
+    `source` names the quarterly index to read, one of INDEX_SOURCES.
+
+    When reprocessing, the quarter is skipped if EDGAR reports the index
+    unchanged since it was last processed. If the index has only grown,
+    just the lines added since then are parsed.
     """
-    edgar_host = 'ftp://ftp.sec.gov'
-    path = '/edgar/full-index/{0}/QTR{1}/company.zip'.format(year, quarter)
-    url = edgar_host + path
+    archive_name = INDEX_SOURCES[source][0]
+    path = '/edgar/full-index/{0}/QTR{1}/{2}'.format(year, quarter, archive_name)
     ifile, _ = IndexFile.objects.get_or_create(
         year=year, quarter=quarter, defaults=dict(filename=path))
     if ifile.complete and not reprocess:
         return
-    ifile.downloaded = timezone.now()
-    ifile.save()
-
-    unique_companies = set()
-    bulk_companies = set()
-    bulk_indexes = []
-
-    if not os.path.isdir(DATA_DIR):
-        os.makedirs(DATA_DIR)
-    fn = os.path.join(DATA_DIR, 'company_%d_%d.zip' % (year, quarter))
-    if os.path.exists(fn) and reprocess:
-        os.remove(fn)
-    if not os.path.exists(fn):
-        try:
-            compressed_data = urllib.urlopen(url).read()
-        except IOError as e:
-            get_filing_list.retry()
-        fileout = file(fn, 'w')
-        fileout.write(compressed_data)
-        fileout.close()
-
-    zip = ZipFile(fn)
-    zdata = zip.read('company.idx')
-    lines = zdata.split('\n')
-
-    for form_line in lines[10:]:
-        if form_line.strip() == '':
-            continue
-        cik = int(form_line[74:86].strip())
-        filename = form_line[98:].strip()
-        form = form_line[62:74].strip()
-        name = form_line[0:62].strip()
-        dt = form_line[86:98].strip()
-        dt = date(*map(int, dt.split('-')))
-
-        if form in ['10-K', '10-Q', '20-F', '10-K/A', '10-Q/A', '20-F/A']:
-            if not Index.objects.filter(company__cik=cik, form=form, date=dt, filename=filename).exists():
-                unique_companies.add(Company(cik=cik, name=name))
-                bulk_indexes.append(Index(company_id=cik, form=form, date=dt, year=year, quarter=quarter, filename=filename,))
-
-    bulk_companies = {company for company in unique_companies
-                     if not Company.objects.filter(cik=company.cik).exists()}
+    with ifile.claimed() as won:
+        if not won:
+            logger.info('{0} is being imported by another worker, skipping'.format(path))
+            return
+        # Another worker may have completed the quarter since it was read.
+        ifile.refresh_from_db()
+        if ifile.complete and not reprocess:
+            logger.info('{0} was imported by another worker, skipping'.format(path))
+            return
+        import_filing_list(ifile, year, quarter, reprocess, source)
+
+
+def import_filing_list(ifile, year, quarter, reprocess, source):
+    """
+    Downloads and parses a quarterly index and stores its new companies
+    and filings, see get_filing_list().
+    """
+    archive_name, member_name, parse_index = INDEX_SOURCES[source]
+    edgar_host = 'https://www.sec.gov/Archives'
+    path = '/edgar/full-index/{0}/QTR{1}/{2}'.format(year, quarter, archive_name)
+    url = edgar_host + path
+    # Only compare against the last run if it read the same index.
+    baseline = ifile.complete and ifile.filename == path and ifile.content_hash
+
+    unique_companies = {}
+    seen_indexes = set()
+
+    makedirs(DATA_DIR)
+    fn = os.path.join(DATA_DIR, '%s_%d_%d.zip' % (source, year, quarter))
+    # Pick up from the download of an attempt that stopped before the
+    # quarter was complete, e.g. on a retry or a worker restart.
+    resume = (ifile.status != c.LOADED and ifile.filename == path and ifile.downloaded
+              and (ifile.complete is None or ifile.downloaded > ifile.complete)
+              and os.path.exists(fn))
+    if resume:
+        logger.info('Resuming {0} from its download of {1}'.format(path, ifile.downloaded))
+    else:
+        start = time.time()
+        # No download time to record if the index on disk is reused.
+        seconds = None
+        if not os.path.exists(fn) or reprocess:
+            headers = {}
+            if baseline and ifile.etag:
+                headers['If-None-Match'] = ifile.etag
+            if baseline and ifile.last_modified:
+                headers['If-Modified-Since'] = ifile.last_modified
+            try:
+                response = get_fetcher().download(url, fn, headers=headers)
+            except FetchError as e:
+                ifile.set_status(c.FAILED, error=force_text(e))
+                get_filing_list.retry(exc=e)
+            if response is None:
+                logger.info('{0} unchanged since {1}, skipping'.format(path, ifile.complete))
+                return
+            ifile.etag = response.headers.get('etag')
+            ifile.last_modified = response.headers.get('last-modified')
+            seconds = time.time() - start
+        ifile.set_status(c.DOWNLOADED, seconds,
+                         filename=path, etag=ifile.etag, last_modified=ifile.last_modified)
+
+    start = time.time()
+    with ZipFile(fn) as zip:
+        reader = HashingReader(zip.open(member_name)).skip_header()
+        appended = False
+        if baseline and ifile.size:
+            # If the data lines previously processed are a prefix of this
+            # index's, only the appended lines need to be parsed.
+            reader.skip(ifile.size)
+            if reader.size == ifile.size and reader.hexdigest() == ifile.content_hash:
+                appended = True
+            else:
+                reader = HashingReader(zip.open(member_name)).skip_header()
+        for record in parse_index(reader, header=False):
+            seen_indexes.add((record.cik, record.form, record.date, record.filename))
+            unique_companies.setdefault(record.cik, record.name)
+    if appended:
+        logger.info('Parsed {0} new lines of {1}'.format(reader.line_count - ifile.line_count, path))
+    ifile.content_hash = reader.hexdigest()
+    ifile.size = reader.size
+    ifile.line_count = reader.line_count
+    ifile.set_status(c.PARSED, time.time() - start)
+
+    # Reconcile against what is already stored in a handful of queries
+    # rather than one existence check per index line, so a resumed
+    # attempt only inserts what the last one did not.
+    start = time.time()
+    existing_indexes = set(
+        Index.objects.filter(year=year, quarter=quarter)
+        .values_list('company_id', 'form', 'date', 'filename'))
+    bulk_indexes = [
+        Index(company_id=cik, form=form, date=dt, year=year, quarter=quarter, filename=filename)
+        for cik, form, dt, filename in seen_indexes - existing_indexes]
+
+    ciks = sorted(unique_companies)
+    existing_ciks = set()
+    for i in range(0, len(ciks), LOOKUP_CHUNK_SIZE):
+        existing_ciks.update(
+            Company.objects.filter(cik__in=ciks[i:i + LOOKUP_CHUNK_SIZE])
+            .values_list('cik', flat=True))
+    bulk_companies = [Company(cik=cik, name=name)
+                      for cik, name in unique_companies.iteritems()
+                      if cik not in existing_ciks]
     if bulk_companies:
         try:
             Company.objects.bulk_create(bulk_companies, batch_size=1000)
-        except:
+        except Exception as e:
+            ifile.set_status(c.FAILED, error=force_text(e))
             get_filing_list.retry()
     Index.objects.bulk_create(bulk_indexes, batch_size=2500)
-    IndexFile.objects.filter(id=ifile.id).update(complete=timezone.now())
+    ifile.set_status(
+        c.LOADED, time.time() - start,
+        error=None,
+        complete=timezone.now(),
+        content_hash=ifile.content_hash,
+        size=ifile.size,
+        line_count=ifile.line_count,
+        etag=ifile.etag,
+        last_modified=ifile.last_modified)
     time_to_complete = ifile.complete - ifile.downloaded
     logger.info('Added {0} in {1} seconds'.format(ifile.filename, time_to_complete))
 
 
-@shared_task
-def import_attrs(**kwargs):
-    ifile = Index.objects.get(filename=kwargs['filename'])
-    ifile.download(verbose=kwargs['verbose'])
+def read_filing(ifile):
+    """
+    Returns the parsed XBRL instance of a downloaded filing, or None after
+    recording the error on the Index.
+    """
     x = None
     error = None
     try:
@@ -122,68 +219,305 @@ def import_attrs(**kwargs):
         traceback.print_exc(file=ferr)
         error = ferr.getvalue()
         print error
-        Index.objects.filter(id=ifile.id).update(valid=False, error=error)
+        ifile.set_status(c.FAILED, valid=False, error=error)
+        return None
 
     if x is None:
         error = 'No XBRL found.'
-        Index.objects.filter(id=ifile.id).update(valid=False, error=error)
-        return
-        
+        ifile.set_status(c.FAILED, valid=False, error=error)
+    return x
+
+
+def parse_filing_files(ifile):
+    """
+    Returns the parsed XBRL instance of a downloaded filing like
+    read_filing(), recording how long parsing took unless an earlier
+    parse was reused from the cache.
+    """
+    cached = XBRL_CACHE and ifile.xbrl_cachefile()
+    start = time.time()
+    x = read_filing(ifile)
+    if x is not None and not cached:
+        ifile.set_status(c.PARSED, time.time() - start)
+    return x
+
+
+def download_filing_files(ifile, verbose=False):
+    """
+    Downloads a filing unless it is already on disk, recording the error
+    on the Index if it cannot be. Returns True if it is available.
+    """
+    on_disk = ifile.xbrl_localpath(download=False)[0]
+    start = time.time()
+    if not ifile.download(verbose=verbose):
+        ifile.set_status(c.FAILED)
+        return False
+    if not on_disk:
+        ifile.set_status(c.DOWNLOADED, time.time() - start)
+    return True
+
+
+# How many stages of the pipeline, download, parse and load, a filing of
+# each status has completed.
+STAGES_DONE = {
+    c.DOWNLOADED: 1,
+    c.PARSED: 2,
+    c.LOADED: 3,
+}
+
+
+def already_done(ifile, status, force=False):
+    """
+    Re-reads the status of a filing whose claim was just won, and returns
+    True if another worker has since taken it to `status` or further, so
+    a duplicate task can skip it. Always False if `force` is set.
+    """
+    if force:
+        return False
+    ifile.refresh_from_db(fields=['status'])
+    if STAGES_DONE.get(ifile.status, 0) >= STAGES_DONE[status]:
+        logger.info('{0} is already {1}, skipping'.format(ifile.filename, ifile.status))
+        return True
+    return False
+
+
+def load_filing(ifile, verbose=False, force=False):
+    """
+    Downloads and parses a filing, then stores its attribute values in a
+    single transaction. Errors are recorded on the Index.
+
+    Returns True if the values were stored, or None if another worker is
+    loading the filing or has loaded it, unless `force` is set.
+    """
+    with ifile.claimed() as won:
+        if not won:
+            logger.info('{0} is being loaded by another worker, skipping'.format(ifile.filename))
+            return None
+        if already_done(ifile, c.LOADED, force):
+            return None
+        if not download_filing_files(ifile, verbose=verbose):
+            return False
+        x = parse_filing_files(ifile)
+        if x is None:
+            return False
+        return store_values(ifile, x)
+
+
+def load_index(index_id, verbose=False, force=False):
+    """
+    Loads the filing with the given Index id, see load_filing().
+    """
+    ifile = Index.objects.select_related('company').get(id=index_id)
+    return load_filing(ifile, verbose=verbose, force=force)
+
+
+# How many times a transaction the database aborts, e.g. to break a
+# deadlock between loaders, is attempted, and the delay in seconds before
+# the first retry. The delay doubles on each further attempt.
+LOCK_ATTEMPTS = 4
+LOCK_BACKOFF = 0.5
+
+
+def atomic_retry(func, *args, **kwargs):
+    """
+    Calls `func` in a transaction, running it again if the database aborts
+    the transaction with an OperationalError such as a deadlock.
+    """
+    for attempt in range(LOCK_ATTEMPTS):
+        try:
+            with transaction.atomic():
+                return func(*args, **kwargs)
+        except OperationalError as e:
+            if attempt == LOCK_ATTEMPTS - 1:
+                raise
+            delay = LOCK_BACKOFF * 2 ** attempt
+            logger.warning('Retrying in {0:.1f}s after: {1}'.format(delay, e))
+            time.sleep(delay)
+
+
+def store_values(ifile, x):
+    """
+    Stores the values of every period the parsed filing `x` reports, in
+    a single transaction. Returns False if the database refused them.
+    """
+    start = time.time()
     while 1:
         try:
             company = ifile.company
-            bulk_objects = []
-            for node in x.iter_namespace():
-                matches = re.findall('^\{([^\}]+)\}(.*)$', node.tag)
-                if matches:
-                    ns, attr_name = matches[0]
-                else:
-                    ns = None
-                    attr_name = node
-
-                context_id = node.attrib['contextRef']
-                if context_id not in [x.fields['ContextForInstants'], x.fields['ContextForDurations']]:
+            facts = []
+            seen = set()
+            for fact in x.iter_namespace():
+                ns, attr_name = fact.namespace.strip(), fact.name
+
+                # Every period the filing reports without dimensions,
+                # including prior years given for comparison.
+                context_id = fact.context_ref
+                if context_id not in x.periods:
                     continue
                 start_date = x.get_context_start_date(context_id)
                 end_date = x.get_context_end_date(context_id)
 
-                if not node.attrib.get('unitRef', None):
+                if not fact.unit_ref:
                     continue
 
-                namespace, _ = Namespace.objects.get_or_create(name=ns.strip())
-                attribute, _ = Attribute.objects.get_or_create(namespace=namespace,
-                                                                      name=attr_name)
-                unit, _ = Unit.objects.get_or_create(name=node.attrib['unitRef'].strip())
-                value = (node.text or '').strip()
+                value = (fact.text or '').strip()
                 if not value:
                     continue
                 assert len(value.split('.')[0]) <= MAX_QUANTIZE, \
                     'Value too large, must be less than %i digits: %i %s' \
                     % (MAX_QUANTIZE, len(value), repr(value))
 
-                Attribute.objects.filter(id=attribute.id).update(total_values_fresh=False)
-                if AttributeValue.objects.filter(company=company, attribute=attribute, start_date=start_date, end_date=end_date).exists():
+                # The same value is often repeated in several contexts
+                # with the same period.
+                key = (ns, attr_name, start_date, end_date)
+                if key in seen:
                     continue
+                seen.add(key)
+                facts.append((ns, attr_name, start_date, end_date, fact.unit_ref.strip(), value))
+
+            # Resolve every name the filing uses at once. These rows are
+            # shared by all filings, so they are committed on their own.
+            namespace_ids = lookups.namespaces.get_many(
+                (ns,) for ns, _, _, _, _, _ in facts)
+            attribute_ids = lookups.attributes.get_many(
+                (namespace_ids[(ns,)], attr_name) for ns, attr_name, _, _, _, _ in facts)
+            unit_ids = lookups.units.get_many(
+                (unit,) for _, _, _, _, unit, _ in facts)
+
+            bulk_objects = []
+            for ns, attr_name, start_date, end_date, unit, value in facts:
                 bulk_objects.append(AttributeValue(
                     company=company,
-                    attribute=attribute,
+                    attribute_id=attribute_ids[(namespace_ids[(ns,)], attr_name)],
                     start_date=start_date,
                     end_date=end_date,
                     value=value,
-                    unit=unit,
+                    unit_id=unit_ids[(unit,)],
                     filing_date=ifile.date,
                 ))
-
-            if bulk_objects:
-                AttributeValue.objects.bulk_create(bulk_objects)
-                bulk_objects = []
-
-            #ticker = ifile.ticker()
-            #Index.objects.filter(id=ifile.id).update(attributes_loaded=True, _ticker=ticker)
-            Attribute.do_update()
-            #Unit.do_update()
-            break
+            def load():
+                counts, skipped = AttributeValue.bulk_load(company.pk, bulk_objects)
+                # Lets an interrupted sec_import_attrs resume where it was.
+                ifile.set_status(c.LOADED, time.time() - start, attributes_loaded=True)
+                return counts, skipped
+            counts, skipped = atomic_retry(load)
+            logger.info('Loaded {0} values from {1}, {2} already stored'.format(
+                sum(counts.values()), ifile.filename, skipped))
+            try:
+                atomic_retry(Attribute.add_values, counts)
+            except DatabaseError as e:
+                # The values are stored; update_total_values() corrects
+                # the counts later.
+                logger.error('Could not count the values of {0}: {1}'.format(ifile.filename, e))
+            return True
 
         except DatabaseError as e:
             logger.error(e)
-            break
+            ifile.set_status(c.FAILED, error=force_text(e))
+            return False
+
+
+@shared_task
+def import_attrs(**kwargs):
+    ifile = Index.objects.get(filename=kwargs['filename'])
+    load_filing(ifile, verbose=kwargs.get('verbose', False), force=kwargs.get('force', False))
+
+
+@shared_task
+def import_attrs_batch(index_ids, verbose=False, force=False):
+    """
+    Loads the filings with the given Index ids one after the other, each
+    in its own transaction, so that small filings do not each cost a
+    message and the dimension caches are reused between them.
+
+    The filings are loaded oldest first, in the order sec_import_attrs
+    queues them, so the values a later filing repeats for comparison are
+    stored with the date of the filing that first reported them.
+    """
+    loaded = 0
+    q = Index.objects.filter(id__in=index_ids).select_related('company')
+    for ifile in q.order_by('company', 'date', 'id'):
+        try:
+            if load_filing(ifile, verbose=verbose, force=force):
+                loaded += 1
+        except Exception:
+            # Do not let one filing fail the rest of the batch.
+            ferr = StringIO()
+            traceback.print_exc(file=ferr)
+            error = ferr.getvalue()
+            logger.error(error)
+            ifile.set_status(c.FAILED, valid=False, error=error)
+    return loaded
+
+
+# The stages of the pipeline started by import_attrs_pipeline(). Each runs
+# on its own queue, see django_stocks.routing, and passes the Index id on,
+# or None once the filing has failed, another worker has claimed it or a
+# duplicate chain already got it past the stage. The stages hand over
+# through the files under DATA_DIR, which their workers must share, the
+# parsed instance included, so DJANGO_STOCKS_XBRL_CACHE must be on.
+
+@shared_task(queue=DOWNLOAD_QUEUE)
+def download_filing(index_id, verbose=False, force=False):
+    ifile = Index.objects.get(id=index_id)
+    with ifile.claimed() as won:
+        if won and not already_done(ifile, c.DOWNLOADED, force) \
+                and download_filing_files(ifile, verbose=verbose):
+            return index_id
+
+
+@shared_task(queue=PARSE_QUEUE)
+def parse_filing(index_id, force=False):
+    """
+    Parses a downloaded filing, saving the result next to it for the load
+    stage.
+    """
+    if index_id is None:
+        return
+    ifile = Index.objects.get(id=index_id)
+    with ifile.claimed() as won:
+        if won and not already_done(ifile, c.PARSED, force) \
+                and parse_filing_files(ifile) is not None:
+            return index_id
+
+
+@shared_task(queue=LOAD_QUEUE)
+def store_filing(index_id, force=False):
+    if index_id is None:
+        return
+    ifile = Index.objects.select_related('company').get(id=index_id)
+    with ifile.claimed() as won:
+        if not won or already_done(ifile, c.LOADED, force):
+            return
+        x = read_filing(ifile)
+        if x is not None and store_values(ifile, x):
+            return index_id
+
+
+def import_attrs_pipeline(index_id, verbose=False, large=False, status=c.PENDING, force=False):
+    """
+    Returns the chain of tasks that downloads, parses and loads a filing,
+    starting after the last stage its `status` says was completed. The
+    filing is parsed on the large queue if `large` is True.
+    """
+    stages = [
+        download_filing.s(verbose=verbose, force=force),
+        parse_filing.s(force=force).set(queue=LARGE_QUEUE) if large else parse_filing.s(force=force),
+        store_filing.s(force=force),
+    ]
+    done = STAGES_DONE.get(status, 0)
+    if done == len(stages):
+        # Only queued again to be reloaded with --force.
+        done = 0
+    stages = stages[done:]
+    return chain(stages[0].clone((index_id,)), *stages[1:])
+
+
+@shared_task
+def update_total_values():
+    """
+    Corrects Attribute.total_values, which imports keep up to date
+    incrementally. Meant to be run periodically, e.g. by celery beat.
+    """
+    changed = Attribute.do_update()
+    logger.info('Corrected total_values of {0} attributes'.format(changed))
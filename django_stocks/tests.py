@@ -0,0 +1,286 @@
+import BaseHTTPServer
+import os
+import random
+import re
+import shutil
+import SocketServer
+import tempfile
+import threading
+import zipfile
+from datetime import date
+from StringIO import StringIO
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import SimpleTestCase, TransactionTestCase
+
+from django_stocks import fetchers, models, remotezip
+from django_stocks.fetchers import FetchError, HTTPFetcher, MirrorFetcher
+from django_stocks.models import Company, Index
+
+
+class RangeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Serves the server's `archive`, honouring single Range requests unless
+    the server's `ignore_range` is set, answering 503 to the request
+    numbers listed in its `failures` and dropping the connection halfway
+    through the body of those listed in its `truncated`.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            number = server.requests
+        if number in server.failures:
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        data = server.archive
+        match = re.match(r'bytes=(\d*)-(\d*)$', self.headers.get('Range', ''))
+        if match and not server.ignore_range:
+            first, last = match.groups()
+            if not first:
+                start, end = max(0, len(data) - int(last)), len(data) - 1
+            else:
+                start, end = int(first), min(int(last or len(data) - 1), len(data) - 1)
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, len(data)))
+            data = data[start:end + 1]
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if number in server.truncated:
+            data = data[:len(data) // 2]
+            self.close_connection = 1
+        self.wfile.write(data)
+        with server.lock:
+            server.bytes_sent += len(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class RangeServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, archive):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), RangeHandler)
+        self.archive = archive
+        self.ignore_range = False
+        self.failures = set()
+        self.truncated = set()
+        self.requests = 0
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+
+
+def make_archive(members):
+    """
+    Returns the bytes of a ZIP archive of (name, data, compression) members.
+    """
+    out = StringIO()
+    with zipfile.ZipFile(out, 'w') as zf:
+        for name, data, compression in members:
+            info = zipfile.ZipInfo(name, (2015, 3, 31, 0, 0, 0))
+            info.compress_type = compression
+            zf.writestr(info, data)
+    return out.getvalue()
+
+
+class FetchInstanceTests(SimpleTestCase):
+    """
+    Reads instances out of archives served by a local server that
+    supports Range requests, as EDGAR's does.
+    """
+
+    def setUp(self):
+        rand = random.Random(1)
+        self.instance = ''.join(
+            '<us-gaap:Assets contextRef="c%d" unitRef="usd">%d</us-gaap:Assets>\n'
+            % (i, rand.randint(0, 10 ** 9)) for i in range(5000))
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.fetcher = HTTPFetcher(retries=2, backoff=0)
+
+    def serve(self, members):
+        server = RangeServer(make_archive(members))
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        # Closing the idle keep-alive connections lets the handlers exit.
+        self.addCleanup(self.fetcher.pool.clear)
+        return server, 'http://127.0.0.1:%d/edgar/data/1/0001-15-000001-xbrl.zip' % server.server_address[1]
+
+    def fetch(self, url):
+        return remotezip.fetch_instance(
+            self.fetcher, url, self.directory, os.path.join(self.directory, 'archive.zip'))
+
+    def read(self, fn):
+        with open(fn, 'rb') as fileobj:
+            return fileobj.read()
+
+    def linkbases(self):
+        return [('abc-20150331_%s.xml' % kind, self.instance * 2, zipfile.ZIP_DEFLATED)
+                for kind in ('cal', 'def', 'lab', 'pre')]
+
+    def test_extracts_only_the_instance(self):
+        server, url = self.serve(
+            [('abc-20150331.xml', self.instance, zipfile.ZIP_DEFLATED),
+             ('abc-20150331.xsd', '<schema/>', zipfile.ZIP_STORED)] + self.linkbases())
+        fn, size = self.fetch(url)
+        self.assertEqual(fn, os.path.join(self.directory, 'abc-20150331.xml'))
+        self.assertEqual(self.read(fn), self.instance)
+        self.assertEqual(size, len(server.archive))
+        self.assertLess(server.bytes_sent, len(server.archive) / 2)
+        self.assertFalse([name for name in os.listdir(self.directory) if name.endswith('.part')])
+
+    def test_extracts_a_stored_instance(self):
+        server, url = self.serve([('abc-20150331.xml', self.instance, zipfile.ZIP_STORED)])
+        fn, _ = self.fetch(url)
+        self.assertEqual(self.read(fn), self.instance)
+
+    def test_reads_a_central_directory_beyond_the_tail(self):
+        members = [('abc-20150331.xml', self.instance, zipfile.ZIP_DEFLATED)]
+        members += [('schedule/%s.htm' % ('r%03d' % i).ljust(120, 'x'), '', zipfile.ZIP_STORED)
+                    for i in range(200)]
+        server, url = self.serve(members)
+        fn, _ = self.fetch(url)
+        self.assertEqual(self.read(fn), self.instance)
+        # The tail, the central directory and the instance.
+        self.assertEqual(server.requests, 3)
+
+    def test_saves_the_archive_when_ranges_are_ignored(self):
+        server, url = self.serve([('abc-20150331.xml', self.instance, zipfile.ZIP_DEFLATED)])
+        server.ignore_range = True
+        fn, size = self.fetch(url)
+        self.assertEqual(fn, os.path.join(self.directory, 'archive.zip'))
+        self.assertEqual(self.read(fn), server.archive)
+        self.assertEqual(size, len(server.archive))
+
+    def test_retries_a_truncated_archive_when_ranges_are_ignored(self):
+        server, url = self.serve([('abc-20150331.xml', self.instance, zipfile.ZIP_DEFLATED)])
+        server.ignore_range = True
+        server.truncated = set([1])
+        fn, _ = self.fetch(url)
+        self.assertEqual(self.read(fn), server.archive)
+        self.assertEqual(server.requests, 2)
+        self.assertEqual(os.listdir(self.directory), ['archive.zip'])
+
+    def test_retries_transient_errors(self):
+        server, url = self.serve([('abc-20150331.xml', self.instance, zipfile.ZIP_DEFLATED)])
+        # The tail request, then the instance request.
+        server.failures = set([1, 3])
+        fn, _ = self.fetch(url)
+        self.assertEqual(self.read(fn), self.instance)
+        self.assertEqual(server.requests, 4)
+
+    def test_gives_up_after_the_retries(self):
+        server, url = self.serve([('abc-20150331.xml', self.instance, zipfile.ZIP_DEFLATED)])
+        server.failures = set([2, 3, 4])
+        with self.assertRaises(FetchError) as raised:
+            self.fetch(url)
+        self.assertEqual(raised.exception.status, 503)
+        self.assertFalse(os.listdir(self.directory))
+
+
+INSTANCE = """<?xml version="1.0" encoding="utf-8"?>
+<xbrli:xbrl xmlns:xbrli="http://www.xbrl.org/2003/instance"
+    xmlns:us-gaap="http://fasb.org/us-gaap/2014-01-31"
+    xmlns:dei="http://xbrl.sec.gov/dei/2014-01-31"
+    xmlns:iso4217="http://www.xbrl.org/2003/iso4217">
+<xbrli:context id="FY"><xbrli:entity><xbrli:identifier scheme="http://www.sec.gov/CIK">%(cik)d</xbrli:identifier></xbrli:entity>
+<xbrli:period><xbrli:startDate>2014-01-01</xbrli:startDate><xbrli:endDate>2014-12-31</xbrli:endDate></xbrli:period></xbrli:context>
+<xbrli:context id="I"><xbrli:entity><xbrli:identifier scheme="http://www.sec.gov/CIK">%(cik)d</xbrli:identifier></xbrli:entity>
+<xbrli:period><xbrli:instant>2014-12-31</xbrli:instant></xbrli:period></xbrli:context>
+<xbrli:unit id="usd"><xbrli:measure>iso4217:USD</xbrli:measure></xbrli:unit>
+<dei:DocumentType contextRef="FY">10-K</dei:DocumentType>
+<dei:DocumentPeriodEndDate contextRef="FY">2014-12-31</dei:DocumentPeriodEndDate>
+<us-gaap:Assets contextRef="I" unitRef="usd">%(cik)d</us-gaap:Assets>
+</xbrli:xbrl>
+"""
+
+
+class IndexConcurrencyTests(TransactionTestCase):
+    """
+    Downloads and opens filings from many threads at once, as Celery's
+    threads, eventlet and gevent pools do.
+    """
+
+    threads = 16
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        data_dir = models.DATA_DIR
+        models.DATA_DIR = os.path.join(self.directory, 'data')
+        self.addCleanup(setattr, models, 'DATA_DIR', data_dir)
+        fetcher = fetchers._fetcher
+        fetchers._fetcher = MirrorFetcher(os.path.join(self.directory, 'mirror'), retries=0)
+        self.addCleanup(setattr, fetchers, '_fetcher', fetcher)
+
+        self.ids = []
+        for cik in range(1001, 1007):
+            company = Company.objects.create(cik=cik, name='COMPANY %d' % cik)
+            accession = '0000%d-15-000001' % cik
+            ifile = Index.objects.create(
+                company=company, form='10-K', date=date(2015, 2, 1), year=2015, quarter=1,
+                filename='edgar/data/%d/%s.txt' % (cik, accession))
+            fn = fetchers._fetcher.localpath(ifile.xbrl_link())
+            models.makedirs(os.path.dirname(fn))
+            with open(fn, 'wb') as fileobj:
+                fileobj.write(make_archive(
+                    [('abc-20141231.xml', INSTANCE % dict(cik=cik), zipfile.ZIP_DEFLATED),
+                     ('abc-20141231.xsd', '<schema/>', zipfile.ZIP_STORED)]))
+            self.ids.append(ifile.id)
+
+    def test_file_methods_are_thread_safe(self):
+        cwd = os.getcwd()
+        results = []
+        errors = []
+        # An in-memory test database only exists on its own connection,
+        # so the threads share it, as LiveServerTestCase's thread does.
+        db = connections[DEFAULT_DB_ALIAS]
+        shared = db.vendor == 'sqlite' and db.is_in_memory_db(db.settings_dict['NAME'])
+        if shared:
+            db.allow_thread_sharing = True
+            self.addCleanup(setattr, db, 'allow_thread_sharing', False)
+
+        def work(offset):
+            if shared:
+                connections[DEFAULT_DB_ALIAS] = db
+            try:
+                # Each thread takes the filings in a different order.
+                for index_id in self.ids[offset:] + self.ids[:offset]:
+                    ifile = Index.objects.select_related('company').get(id=index_id)
+                    downloaded = ifile.download()
+                    path, _ = ifile.xbrl_localpath(download=False)
+                    x = ifile.xbrl()
+                    results.append((ifile.company_id, downloaded, path,
+                                    x.get_fact('us-gaap:Assets', 'I').number, os.getcwd()))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                if not shared:
+                    connections[DEFAULT_DB_ALIAS].close()
+
+        workers = [threading.Thread(target=work, args=(i % len(self.ids),))
+                   for i in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(results), self.threads * len(self.ids))
+        for cik, downloaded, path, assets, result_cwd in results:
+            self.assertTrue(downloaded)
+            self.assertEqual(path, os.path.join(
+                models.DATA_DIR, str(cik), '0000%d-15-000001' % cik, 'abc-20141231.xml'))
+            self.assertEqual(assets, cik)
+            self.assertEqual(result_cwd, cwd)
+        self.assertEqual(os.getcwd(), cwd)
@@ -0,0 +1,190 @@
+"""
+Request rate limiting shared by every process fetching from EDGAR.
+
+The SEC blocks clients that exceed its fair access rate, so all workers
+draw from a single token bucket. The bucket lives in the Django cache
+when a shared cache is configured, or in a locked file under DATA_DIR
+when every worker runs on the same host.
+"""
+import fcntl
+import logging
+import os
+import threading
+import time
+
+from django.core.cache import caches
+
+from django_stocks import settings
+
+logger = logging.getLogger(__name__)
+
+# Cache backends that are private to a process and so cannot be shared.
+LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+# Waits longer than this, in seconds, are logged at INFO level.
+LOG_WAIT_THRESHOLD = 1.0
+
+
+class TokenBucket(object):
+    """
+    Hands out at most `rate` tokens per second, allowing bursts of up to
+    `capacity` tokens.
+
+    The shared state is a single timestamp: the time at which the next
+    token becomes available. Each acquire() reserves a token by advancing
+    it, then sleeps outside of any lock until its reserved time arrives.
+    Subclasses provide _update(), which must apply a function to the
+    stored timestamp atomically.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = float(rate)
+        self.capacity = max(1, capacity)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.requests = 0
+        self.total_wait = 0.0
+
+    def _update(self, func):
+        raise NotImplementedError
+
+    def acquire(self):
+        """
+        Blocks until a token is available. Returns the seconds waited.
+        """
+        now = time.time()
+        interval = 1 / self.rate
+        earliest = now - (self.capacity - 1) * interval
+        reserved = []
+
+        def reserve(next_free):
+            start = max(next_free or 0, earliest)
+            reserved.append(start)
+            return start + interval
+
+        self._update(reserve)
+        wait = max(0.0, reserved[-1] - now)
+        if wait:
+            time.sleep(wait)
+        with self._lock:
+            self.requests += 1
+            self.total_wait += wait
+        self._local.wait = self.thread_wait() + wait
+        if wait >= LOG_WAIT_THRESHOLD:
+            logger.info('Waited %.2fs for an EDGAR request token', wait)
+        else:
+            logger.debug('Waited %.3fs for an EDGAR request token', wait)
+        return wait
+
+    def thread_wait(self):
+        """
+        Returns the total seconds the current thread has waited.
+        """
+        return getattr(self._local, 'wait', 0.0)
+
+    def stats(self):
+        """
+        Returns the number of tokens acquired by this process and the
+        total seconds spent waiting for them.
+        """
+        with self._lock:
+            return dict(requests=self.requests, total_wait=self.total_wait)
+
+
+class CacheTokenBucket(TokenBucket):
+    """
+    Keeps the bucket in a Django cache shared by all workers, using
+    cache.add() as a short lived mutex.
+    """
+
+    def __init__(self, rate, capacity=1, alias='default', key='django_stocks:throttle'):
+        super(CacheTokenBucket, self).__init__(rate, capacity)
+        self.cache = caches[alias]
+        self.key = key
+        self.lock_key = key + ':lock'
+
+    def _update(self, func):
+        while not self.cache.add(self.lock_key, 1, timeout=5):
+            time.sleep(0.001)
+        try:
+            self.cache.set(self.key, func(self.cache.get(self.key)), timeout=None)
+        finally:
+            self.cache.delete(self.lock_key)
+
+
+class FileTokenBucket(TokenBucket):
+    """
+    Keeps the bucket in a file guarded by an exclusive flock(), for when
+    all workers share one host.
+    """
+
+    def __init__(self, rate, capacity=1, path=None):
+        super(FileTokenBucket, self).__init__(rate, capacity)
+        self.path = path or os.path.join(settings.DATA_DIR, 'throttle')
+
+    def _update(self, func):
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            data = os.read(fd, 64)
+            try:
+                next_free = float(data)
+            except ValueError:
+                next_free = None
+            data = repr(func(next_free))
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.ftruncate(fd, 0)
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+
+
+class NullTokenBucket(TokenBucket):
+    """
+    Never waits.
+    """
+
+    def __init__(self, rate=None, capacity=1):
+        super(NullTokenBucket, self).__init__(1, capacity)
+
+    def acquire(self):
+        with self._lock:
+            self.requests += 1
+        return 0.0
+
+
+_governor = None
+
+
+def get_governor():
+    """
+    Returns the token bucket configured by the DJANGO_STOCKS_RATE_LIMIT
+    settings, preferring the Django cache when it is shared between
+    processes.
+    """
+    global _governor
+    if _governor is None:
+        backend = settings.RATE_LIMIT_BACKEND
+        if not settings.RATE_LIMIT:
+            backend = None
+        elif backend == 'auto':
+            cache_backend = caches['default'].__class__
+            cache_backend = '%s.%s' % (cache_backend.__module__, cache_backend.__name__)
+            backend = 'file' if cache_backend in LOCAL_CACHE_BACKENDS else 'cache'
+        if backend == 'cache':
+            _governor = CacheTokenBucket(settings.RATE_LIMIT, settings.RATE_LIMIT_BURST)
+        elif backend == 'file':
+            _governor = FileTokenBucket(settings.RATE_LIMIT, settings.RATE_LIMIT_BURST)
+        else:
+            _governor = NullTokenBucket()
+    return _governor
@@ -1,5 +1,6 @@
 import re
-import urllib2
+
+from django_stocks.fetchers import get_fetcher
 
 
 def lookup_cik(ticker, name=None):
@@ -13,9 +14,7 @@ def lookup_cik(ticker, name=None):
     url = 'http://www.sec.gov/cgi-bin/browse-edgar?CIK={cik}&owner=exclude&Find=Find+Companies&action=getcompany'.format(cik=ticker)
     #print 'url1:',url
     #response = urllib2.urlopen(url)
-    request = urllib2.Request(url=url)
-    response = urllib2.urlopen(request)
-    data = response.read()
+    data = get_fetcher().read(url)
     try:
         match = re.finditer('CIK=([0-9]+)', data).next()
         return match.group().split('=')[-1]
@@ -36,9 +35,7 @@ def lookup_cik(ticker, name=None):
         for i in xrange(len(name_parts)):
             url = 'http://www.sec.gov/cgi-bin/cik.pl.c?company={company}'.format(company='+'.join(name_parts[:-(i+1)]))
 #            response = urllib2.urlopen(url)
-            request = urllib2.Request(url=url)
-            response = urllib2.urlopen(request)
-            data = response.read()
+            data = get_fetcher().read(url)
             matches = re.findall('CIK=([0-9]+)', data)
             if len(matches) == 1:
                 return matches[0]
@@ -49,9 +46,7 @@ def lookup_cik(ticker, name=None):
     url = 'http://finance.yahoo.com/q/sec?s={symbol}+SEC+Filings'.format(symbol=ticker)
     #print 'url2:',url
 #    response = urllib2.urlopen(url)
-    request = urllib2.Request(url=url)
-    response = urllib2.urlopen(request)
-    data = response.read()
+    data = get_fetcher().read(url)
     try:
         match = re.finditer('search/\?cik=([0-9]+)', data).next()
         return match.group().split('=')[-1]
@@ -1,62 +1,511 @@
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
 from datetime import date
-from lxml import etree
+import gc
+import marshal
 import re
+import struct
+import threading
+import zlib
+
+from lxml import etree
+
+from django_stocks.fetchers import atomic_write
 
 import constants as c
 
-class XBRL:
+XBRLI = 'http://www.xbrl.org/2003/instance'
+XSI_NIL = '{http://www.w3.org/2001/XMLSchema-instance}nil'
+
+# Marks a Fact whose numeric value has not been computed yet.
+_UNSET = object()
+
+# Version of what the parser extracts from an instance. Increase it whenever
+# that changes so that files written by XBRL.save() are parsed again.
+PARSER_VERSION = 1
+
+# Header of files written by XBRL.save(): a magic string and the parser
+# version, followed by the zlib compressed, marshalled contents.
+CACHE_HEADER = struct.Struct('<4sH')
+CACHE_MAGIC = 'DSXB'
+
+# Lengths in days of the durations classified as each kind of period.
+# 52-53 week fiscal years and quarters vary by a week or so.
+PERIOD_LENGTHS = (
+    (c.FISCAL_YEAR, 350, 380),
+    (c.FISCAL_QUARTER, 80, 100),
+    (c.YEAR_TO_DATE, 170, 190),
+    (c.YEAR_TO_DATE, 260, 280),
+)
+
+# A period ending within this many days of a whole number of years before
+# the document period end date is a comparative period for that year.
+PERIOD_TOLERANCE = 10
+
+# The classification of a context: its kind, one of c.PERIOD_KINDS, and how
+# many years before the document period it ends, or None if it does not end
+# on a comparable date.
+Period = namedtuple('Period', 'kind years_back')
+
+# Maximum number of compiled XPath expressions kept by compile_xpath().
+XPATH_CACHE_SIZE = 256
+
+# A namespace prefix used in an XPath expression, e.g. "us-gaap" in
+# "//us-gaap:Assets". Axes such as "child::" are followed by a second colon.
+XPATH_PREFIX = re.compile(r'([A-Za-z_][\w.-]*):(?=[A-Za-z_*])')
+
+_xpath_cache = OrderedDict()
+_xpath_cache_lock = threading.Lock()
+_xpath_cache_stats = {'hits': 0, 'misses': 0}
+
+
+def compile_xpath(expression, namespaces):
+    """
+    Returns a compiled etree.XPath for the expression and namespace
+    prefixes from a bounded, least recently used cache.
+
+    Only the prefixes the expression uses are part of the key, since every
+    filing maps its own extension prefix, and dated versions of the
+    standard ones, in its namespaces.
+
+    Values should be passed as XPath variables, e.g. "//*[@contextRef=$ctx]",
+    rather than formatted into the expression, so that it can be reused.
+    """
+    namespaces = dict((prefix, namespaces[prefix])
+                      for prefix in set(XPATH_PREFIX.findall(expression))
+                      if prefix in namespaces)
+    key = (expression, tuple(sorted(namespaces.items())))
+    with _xpath_cache_lock:
+        xpath = _xpath_cache.pop(key, None)
+        if xpath is not None:
+            _xpath_cache_stats['hits'] += 1
+            _xpath_cache[key] = xpath
+            return xpath
+        _xpath_cache_stats['misses'] += 1
+    xpath = etree.XPath(expression, namespaces=namespaces)
+    with _xpath_cache_lock:
+        _xpath_cache[key] = xpath
+        while len(_xpath_cache) > XPATH_CACHE_SIZE:
+            _xpath_cache.popitem(last=False)
+    return xpath
+
+
+def xpath_cache_info():
+    """
+    Returns the hits, misses and current size of the XPath cache.
+    """
+    with _xpath_cache_lock:
+        return dict(_xpath_cache_stats, size=len(_xpath_cache), maxsize=XPATH_CACHE_SIZE)
+
+
+def parse_date(value):
+    """
+    Converts a YYYY-MM-DD string to a date, or None if it is not one.
+    """
+    try:
+        return date(*map(int, value.strip()[:10].split('-')))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def parse_unit(node):
+    """
+    Returns the measure of an <xbrli:unit>, joining the numerator and
+    denominator of a ratio with "/".
+    """
+    divide = node.find('{%s}divide' % XBRLI)
+    if divide is not None:
+        return '%s/%s' % (
+            ' '.join(m.text.strip() for m in divide.iterfind('{%s}unitNumerator/{%s}measure' % (XBRLI, XBRLI))),
+            ' '.join(m.text.strip() for m in divide.iterfind('{%s}unitDenominator/{%s}measure' % (XBRLI, XBRLI))))
+    return ' '.join(m.text.strip() for m in node.iterfind('{%s}measure' % XBRLI))
+
+
+class Context(object):
+    """
+    The parts of an <xbrli:context> needed to place its facts in time.
+
+    `start` is the start date of a duration or the date of an instant,
+    `end` is the end date of a duration and None for an instant.
+    """
+    __slots__ = ('id', 'start', 'end', 'instant', 'has_segment', 'entity')
+
+    def __init__(self, id, start, end, instant, has_segment, entity):
+        self.id = id
+        self.start = start
+        self.end = end
+        self.instant = instant
+        self.has_segment = has_segment
+        self.entity = entity
+
+    @classmethod
+    def from_element(cls, node):
+        entity = node.find('{%s}entity' % XBRLI)
+        identifier = None
+        has_segment = False
+        if entity is not None:
+            identifier = entity.findtext('{%s}identifier' % XBRLI)
+            has_segment = entity.find('{%s}segment' % XBRLI) is not None
+        period = node.find('{%s}period' % XBRLI)
+        start = end = None
+        instant = False
+        if period is not None:
+            instant_text = period.findtext('{%s}instant' % XBRLI)
+            if instant_text is not None:
+                instant = True
+                start = parse_date(instant_text)
+            else:
+                start = parse_date(period.findtext('{%s}startDate' % XBRLI))
+                end = parse_date(period.findtext('{%s}endDate' % XBRLI))
+        return cls(node.get('id'), start, end, instant, has_segment,
+                   identifier.strip() if identifier else identifier)
+
+    @property
+    def period_end(self):
+        """
+        The date the context's period ends on.
+        """
+        if self.instant:
+            return self.start
+        return self.end
+
+
+def classify_period(context, document_end):
+    """
+    Returns the Period of a context relative to the document period end
+    date, or None if its dates are unknown.
+    """
+    end = context.period_end
+    if end is None or document_end is None:
+        return None
+    if context.instant:
+        kind = c.INSTANT
+    else:
+        if context.start is None:
+            return None
+        kind = c.DURATION
+        length = (end - context.start).days
+        for period_kind, shortest, longest in PERIOD_LENGTHS:
+            if shortest <= length <= longest:
+                kind = period_kind
+                break
+    days = (document_end - end).days
+    years_back = int(round(days / 365.25))
+    if abs(days - years_back * 365.25) > PERIOD_TOLERANCE:
+        years_back = None
+    return Period(kind, years_back)
+
+
+class Fact(object):
+    """
+    A single reported value, e.g. <us-gaap:Assets contextRef=...>.
+
+    `tag` and `attrib` mirror the lxml element the fact was read from.
+    """
+    __slots__ = ('namespace', 'name', 'context_ref', 'unit_ref', 'text', 'nil', '_number')
+
+    def __init__(self, namespace, name, context_ref, unit_ref, text, nil):
+        self.namespace = namespace
+        self.name = name
+        self.context_ref = context_ref
+        self.unit_ref = unit_ref
+        self.text = text
+        self.nil = nil
+        self._number = _UNSET
+
+    @classmethod
+    def from_element(cls, node):
+        namespace, name = node.tag[1:].split('}', 1)
+        return cls(namespace, name, node.get('contextRef'), node.get('unitRef'),
+                   node.text, node.get(XSI_NIL) == 'true')
+
+    @property
+    def tag(self):
+        return '{%s}%s' % (self.namespace, self.name)
+
+    @property
+    def attrib(self):
+        attrib = {'contextRef': self.context_ref}
+        if self.unit_ref is not None:
+            attrib['unitRef'] = self.unit_ref
+        return attrib
+
+    @property
+    def number(self):
+        """
+        The value as a float, 0 if the fact is nil, or None if the value
+        is not numeric.
+        """
+        if self._number is _UNSET:
+            if self.nil:
+                self._number = 0.0
+            else:
+                try:
+                    self._number = float(self.text)
+                except (TypeError, ValueError):
+                    self._number = None
+        return self._number
+
+
+@contextmanager
+def gc_paused():
+    """
+    Suspends the cyclic garbage collector, which otherwise runs over and
+    over while hundreds of thousands of facts are created. Facts and
+    contexts hold no reference cycles.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def date_ordinal(value):
+    if value is None:
+        return None
+    return value.toordinal()
+
+
+def ordinal_date(value):
+    if value is None:
+        return None
+    return date.fromordinal(value)
+
+
+class XBRL(object):
+    """
+    An XBRL instance document.
+
+    By default the whole document is parsed into a tree, kept as
+    `oInstance` for getNodeList() and getNode(). With `streaming=True` it
+    is read incrementally instead, keeping only the contexts, units and
+    facts, which needs a fraction of the memory on large instances. The
+    XPath helpers are not available in that mode, nor on instances
+    restored with load().
+    """
+
+    def __init__(self, XBRLInstanceLocation, opener=None, streaming=False):
+        self._reset(XBRLInstanceLocation)
 
-    def __init__(self, XBRLInstanceLocation, opener=None):
-        self.XBRLInstanceLocation = XBRLInstanceLocation
-        self.fields = {}
-        
         if opener:
             # Allow us to read directly from a ZIP archive without extracting
             # the whole thing.
-            self.EntireInstanceDocument = opener(XBRLInstanceLocation,'r').read()
+            fileobj = opener(XBRLInstanceLocation,'r')
         else:
-            self.EntireInstanceDocument = open(XBRLInstanceLocation,'r').read()
-         
-        self.oInstance = etree.fromstring(self.EntireInstanceDocument)
+            fileobj = open(XBRLInstanceLocation,'rb')
+        try:
+            with gc_paused():
+                if streaming:
+                    self._iterparse(fileobj)
+                else:
+                    self._parse(fileobj)
+        finally:
+            fileobj.close()
+        self.ns['xbrli'] = XBRLI
+        self.ns['xlmns'] = XBRLI
+        self.GetBaseInformation()
+
+    def _reset(self, XBRLInstanceLocation):
+        self.XBRLInstanceLocation = XBRLInstanceLocation
+        self.fields = {}
         self.ns = {}
+        # Context id -> Context, in document order.
+        self.contexts = OrderedDict()
+        # Context id -> Period for every context without segments, set
+        # by GetBaseInformation().
+        self.periods = OrderedDict()
+        # Ids of the instant and duration contexts of the document period,
+        # set by GetBaseInformation().
+        self.root_instant = None
+        self.root_duration = None
+        # Unit id -> measure, e.g. "iso4217:USD" or "iso4217:USD/xbrli:shares".
+        self.units = {}
+        # Every fact, in document order, then indexed by namespace and by
+        # (namespace, name, contextRef).
+        self.facts = []
+        self._facts_by_namespace = {}
+        self._fact_index = {}
+        self.oInstance = None
+
+    def save(self, fn):
+        """
+        Writes the parsed contexts, units and facts to `fn`, to be read
+        back with load() without parsing the document again.
+        """
+        data = marshal.dumps((
+            self.XBRLInstanceLocation,
+            self.ns,
+            [(context.id, date_ordinal(context.start), date_ordinal(context.end),
+              context.instant, context.has_segment, context.entity)
+             for context in self.contexts.itervalues()],
+            self.units,
+            [(fact.namespace, fact.name, fact.context_ref, fact.unit_ref, fact.text, fact.nil)
+             for fact in self.facts],
+        ), 2)
+        with atomic_write(fn) as fileout:
+            fileout.write(CACHE_HEADER.pack(CACHE_MAGIC, PARSER_VERSION))
+            fileout.write(zlib.compress(data, 1))
+
+    @classmethod
+    def load(cls, fn):
+        """
+        Returns the instance saved in `fn` by save().
+
+        Raises ValueError if the file was written by another parser
+        version or is not readable.
+        """
+        with open(fn, 'rb') as filein:
+            data = filein.read()
+        if len(data) < CACHE_HEADER.size:
+            raise ValueError('%s is not a parsed XBRL file' % fn)
+        magic, version = CACHE_HEADER.unpack(data[:CACHE_HEADER.size])
+        if magic != CACHE_MAGIC:
+            raise ValueError('%s is not a parsed XBRL file' % fn)
+        if version != PARSER_VERSION:
+            raise ValueError('%s was written by parser version %s, not %s' % (fn, version, PARSER_VERSION))
+        try:
+            location, ns, contexts, units, facts = marshal.loads(zlib.decompress(data[CACHE_HEADER.size:]))
+        except (zlib.error, EOFError, TypeError, ValueError):
+            raise ValueError('%s is corrupt' % fn)
+
+        self = cls.__new__(cls)
+        self._reset(location)
+        self.ns = ns
+        self.units = units
+        with gc_paused():
+            for id, start, end, instant, has_segment, entity in contexts:
+                self.contexts[id] = Context(id, ordinal_date(start), ordinal_date(end),
+                                            instant, has_segment, entity)
+            for fact in facts:
+                self._add_fact(Fact(*fact))
+        self.GetBaseInformation()
+        return self
+
+    def _parse(self, fileobj):
+        self.oInstance = etree.parse(fileobj).getroot()
         for k in self.oInstance.nsmap.keys():
             if k is not None:
                 self.ns[k] = self.oInstance.nsmap[k]
-        self.ns['xbrli'] = 'http://www.xbrl.org/2003/instance'
-        self.ns['xlmns'] = 'http://www.xbrl.org/2003/instance'
-        self.GetBaseInformation()
-        #self.loadYear()
-        
-        self._context_start_dates = {}
-        self._context_end_dates = {}
+        for node in self.oInstance.iterchildren('{%s}context' % XBRLI):
+            self._add_context(node)
+        for node in self.oInstance.iterchildren('{%s}unit' % XBRLI):
+            self._add_unit(node)
+        for node in self.oInstance.iter(etree.Element):
+            if node.get('contextRef') is not None:
+                self._add_fact(Fact.from_element(node))
 
-    #def loadYear(self):
-    #    self.currentEnd = self.getNode("//dei:DocumentPeriodEndDate").text
-            
-    def getNodeList(self, xpath, root=None):
+    def _iterparse(self, fileobj):
+        context_tag = '{%s}context' % XBRLI
+        unit_tag = '{%s}unit' % XBRLI
+        for event, node in etree.iterparse(fileobj, events=('start-ns', 'end'), huge_tree=True):
+            if event == 'start-ns':
+                prefix, uri = node
+                # Like the root's nsmap, the first declaration of a prefix wins.
+                if prefix:
+                    self.ns.setdefault(prefix, uri)
+                continue
+            if node.tag == context_tag:
+                self._add_context(node)
+            elif node.tag == unit_tag:
+                self._add_unit(node)
+            elif node.get('contextRef') is not None:
+                self._add_fact(Fact.from_element(node))
+            # Discard each top level element once it has been read. Facts
+            # nested in tuples are read before their parent ends.
+            parent = node.getparent()
+            if parent is not None and parent.getparent() is None:
+                node.clear()
+                while node.getprevious() is not None:
+                    del parent[0]
+
+    def loadYear(self, years_back):
+        """
+        Points ContextForInstants and ContextForDurations at the periods
+        ending `years_back` years before the document period, which most
+        10-Ks include for comparison, so that GetFactValue() returns that
+        year's values. loadYear(0) returns to the current period.
+
+        Filings usually carry one balance sheet fewer than income
+        statements, so instant values of the earliest year are None.
+        Returns False, leaving the contexts unchanged, if the filing does
+        not report that year at all.
+        """
+        if years_back == 0:
+            self.fields['ContextForInstants'] = self.root_instant
+            self.fields['ContextForDurations'] = self.root_duration
+            return True
+        duration = self.periods.get(self.root_duration)
+        if duration is None:
+            return False
+        instant_id = self.find_period(c.INSTANT, years_back)
+        duration_id = self.find_period(duration.kind, years_back)
+        if instant_id is None and duration_id is None:
+            return False
+        self.fields['ContextForInstants'] = instant_id
+        self.fields['ContextForDurations'] = duration_id
+        return True
+
+    def find_period(self, kind, years_back):
+        """
+        Returns the id of the first context without segments of the given
+        kind ending `years_back` years before the document period, or None.
+        """
+        period = Period(kind, years_back)
+        for context_id, context_period in self.periods.iteritems():
+            if context_period == period:
+                return context_id
+        return None
+
+    def getNodeList(self, xpath, root=None, **variables):
+        """
+        Evaluates an XPath expression, binding any keyword arguments as
+        XPath variables, e.g. getNodeList("//us-gaap:Assets[@contextRef=$ctx]", ctx=...).
+        """
         if root is None:
             root = self.oInstance
-        oNodelist = root.xpath(xpath, namespaces=self.ns)
+            if root is None:
+                raise ValueError('XPath queries need the document tree, which is not kept when streaming.')
+        oNodelist = compile_xpath(xpath, self.ns)(root, **variables)
         return oNodelist
         
-    def getNode(self, xpath, root=None):
-        oNodelist = self.getNodeList(xpath, root)
+    def getNode(self, xpath, root=None, **variables):
+        oNodelist = self.getNodeList(xpath, root, **variables)
         if len(oNodelist):
             return oNodelist[0]
         return None
 
+    def _add_context(self, node):
+        context = Context.from_element(node)
+        self.contexts[context.id] = context
+
+    def _add_unit(self, node):
+        self.units[node.get('id')] = parse_unit(node)
+
+    def _add_fact(self, fact):
+        self.facts.append(fact)
+        self._facts_by_namespace.setdefault(fact.namespace, []).append(fact)
+        # The first of several facts for the same concept and context wins.
+        self._fact_index.setdefault((fact.namespace, fact.name, fact.context_ref), fact)
+
+    def get_fact(self, SeekConcept, ContextReference):
+        """
+        Returns the Fact for a prefixed concept name, e.g. "us-gaap:Assets",
+        in the given context, or None.
+        """
+        prefix, _, name = SeekConcept.rpartition(':')
+        return self._fact_index.get((self.ns.get(prefix), name, ContextReference))
+
     def iter_namespace(self, ns='us-gaap'):
         """
-        Iterates over all namespace elements, yielding each one.
+        Iterates over all facts in the namespace with the given prefix,
+        yielding each one.
         """
-        SeekConcept = '%s:*' % (ns,)
-        node_list = self.getNodeList("//" + SeekConcept)
-        for node in node_list:
-            yield node
+        return iter(self._facts_by_namespace.get(self.ns.get(ns), ()))
 
     def GetFactValue(self, SeekConcept, ConceptPeriodType):
-                
-        factValue = None
             
         if ConceptPeriodType == c.INSTANT:
             ContextReference = self.fields['ContextForInstants']
@@ -69,63 +518,56 @@ class XBRL:
         if not ContextReference:
             return None
 
-        oNode = self.getNode("//" + SeekConcept + "[@contextRef='" + ContextReference + "']")
-        if oNode is not None:
-            factValue = oNode.text
-            if 'nil' in oNode.keys() and oNode.get('nil')=='true':
-                factValue=0
-                #set the value to ZERO if it is nil
-            #if type(factValue)==str:
-            try:
-                factValue = float(factValue)
-            except:
-                #print 'couldnt convert %s=%s to string' % (SeekConcept,factValue)
-                factValue = None
-                pass
-            
-        return factValue
+        fact = self.get_fact(SeekConcept, ContextReference)
+        if fact is None:
+            return None
+        return fact.number
 
     def GetBaseInformation(self):
-        for node in self.iter_namespace(ns='dei'):
-            tag = re.search('[^{}]*$', node.tag).group()
-            self.fields[tag] = node.text
-
-        # This is super ugly
-        # Instances context references are listed in <xbrli:context> blocks --> "//xbrli:context"
-        # We want the child period that is instance type --> "[(xbrli:period[xbrli:instant"
-        # With text value of DocumentPeriodEndDate --> '[text()="{0}"]])'.format(x.fields['DocumentPeriodEndDate']
-        # But there are many contextRefs with this date.  We want the "root" one with no segments --> "and (xbrli:entity[not (xbrli:segment)])]"
-        context = '//xbrli:context'
-        period = '[(xbrli:period'
-        instant = '[xbrli:instant'
-        duration = '[xbrli:endDate'
-        text = '[text()="{0}"]])'.format(self.fields['DocumentPeriodEndDate'])
-        entity = ' and (xbrli:entity'
-        segment = '[not (xbrli:segment)])]'
-        instant_xpath = context + period + instant + text + entity + segment
-        duration_xpath = context + period + duration + text + entity + segment
-        self.fields['ContextForInstants'] = self.oInstance.xpath(instant_xpath,namespaces=self.ns)[0].get('id')
-        self.fields['ContextForDurations'] = self.oInstance.xpath(duration_xpath,namespaces=self.ns)[0].get('id')
+        for fact in self.iter_namespace(ns='dei'):
+            self.fields[fact.name] = fact.text
+
+        # The root contexts are the ones without segments whose period
+        # ends on the DocumentPeriodEndDate.
+        self.root_instant = self.find_root_context(
+            self.fields['DocumentPeriodEndDate'], instant=True).id
+        self.root_duration = self.find_root_context(
+            self.fields['DocumentPeriodEndDate'], instant=False).id
+        self.fields['ContextForInstants'] = self.root_instant
+        self.fields['ContextForDurations'] = self.root_duration
+
+        document_end = parse_date(self.fields['DocumentPeriodEndDate'])
+        self.periods.clear()
+        for context in self.contexts.itervalues():
+            if not context.has_segment:
+                period = classify_period(context, document_end)
+                if period is not None:
+                    self.periods[context.id] = period
+
+    def find_root_context(self, end_date, instant):
+        """
+        Returns the first context without segments that is an instant on,
+        or a duration ending on, the given YYYY-MM-DD date.
+        """
+        end_date = parse_date(end_date)
+        for context in self.contexts.itervalues():
+            if context.instant == instant and not context.has_segment \
+                    and context.period_end == end_date and end_date is not None:
+                return context
+        raise ValueError('No %s context without segments ends on %s' % (
+            c.INSTANT if instant else c.DURATION, end_date))
 
     def get_context_start_date(self, context_id):
-        if context_id not in self._context_start_dates:
-            node = self.getNode("//xbrli:context[@id='" + context_id + "']/xbrli:period/xbrli:startDate")
-            if node is None:
-                node = self.getNode("//xbrli:context[@id='" + context_id + "']/xbrli:period/xbrli:instant")
-            dt = None
-            if node is not None and node.text:
-                dt = date(*map(int, node.text.split('-')))
-            self._context_start_dates[context_id] = dt
-        return self._context_start_dates[context_id]
+        context = self.contexts.get(context_id)
+        if context is None:
+            return None
+        return context.start
 
     def get_context_end_date(self, context_id):
-        if context_id not in self._context_end_dates:
-            node = self.getNode("//xbrli:context[@id='" + context_id + "']/xbrli:period/xbrli:endDate")
-            dt = None
-            if node is not None and node.text:
-                dt = date(*map(int, node.text.split('-')))
-            self._context_end_dates[context_id] = dt
-        return self._context_end_dates[context_id]
+        context = self.contexts.get(context_id)
+        if context is None:
+            return None
+        return context.end
         
     def GetCurrentPeriodAndContextInformation(self, EndDate):
         #Figures out the current period and contexts for the current period instance/duration contexts
@@ -176,14 +618,12 @@ class XBRL:
         #Finds something
         something = None
         
-        #See if there are any nodes with the document period focus date
-        oNodeList_Alt = self.getNodeList("//xbrli:context[xbrli:period/xbrli:instant='" + self.fields['BalanceSheetDate'] + "']")
-
-        #MsgBox "Node list length: " + oNodeList_Alt.length
-        for oNode_Alt in oNodeList_Alt:
+        #See if there are any contexts with the document period focus date
+        balance_sheet_date = parse_date(self.fields['BalanceSheetDate'])
+        for context in self.contexts.itervalues():
+            if not context.instant or context.start != balance_sheet_date:
+                continue
             #Found possible contexts
-            #MsgBox oNode_Alt.selectSingleNode("@id").text
-            something = self.getNode("//us-gaap:Assets[@contextRef='" + oNode_Alt.get("id") + "']")
+            something = self.get_fact("us-gaap:Assets", context.id)
             if something is not None:
-                #MsgBox "Use this context: " + oNode_Alt.selectSingleNode("@id").text
-                return oNode_Alt.get("id")
+                return context.id
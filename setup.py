@@ -22,7 +22,7 @@ setup(
         'Framework :: Django',
     ],
     zip_safe = False,
-    install_requires = ['Django>=1.8.0',
+    install_requires = ['Django>=1.9',
                         'lxml',
                         'mock',
                         'celery==3.1.18',